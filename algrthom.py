@@ -1,6 +1,9 @@
 import os
 import json
-from app import mechanization
+import app
+
+app.bootstrap()
+mechanization = app.mechanization
 from itertools import combinations
 
 def run_CRW4(batchName, batch): # 秉榮: 修改此處，加入 batchName 參數
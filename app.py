@@ -1,19 +1,58 @@
+import threading
+
 from flask_restx import Resource
 from logger import logger
 
 from payload import (
-    api_ns, api, app, api_test,
+    api_ns, api, app, api_test, api_hazard,
+    hazard_query_parser,
+    hazard_output_payload,
     queue_list_payload,
+    cas_list_payload,
+    resolution_payload,
     add_chemical_input_payload,
     general_output_payload
 )
 from tasks import CRW4Mechanization, CRW4Factory, CRW4Algorithm
-from util import handle_request_exception
+from scheduler import CRW4Scheduler, INTERACTIVE, DAILY, BACKFILL
+from util import handle_request_exception, export_archive
+from cas import preflight, normalize_cas
+
+
+# 由 bootstrap() 在主行程中建立；Windows 以 spawn 建立子行程 (例如 pairs.parse_exports) 時會以 __mp_main__
+# 重新匯入本模組，模組層級不能啟動 CRW4 或排程器
+crw4_automation = None
+mechanization = None
+algorithom = None
+scheduler = None
+backlog_lock = threading.Lock()  # 同時只執行一次歷史 xlsx 匯入
 
+def bootstrap():
+    """啟動 CRW4 並建立排程器"""
+    global crw4_automation, mechanization, algorithom, scheduler
+    crw4_automation = CRW4Factory.get_crw4_automation()
+    mechanization = CRW4Mechanization(crw4_automation)
+    algorithom = CRW4Algorithm(mechanization)
+    scheduler = CRW4Scheduler()  # 所有 CRW4 操作依優先等級排隊，回補批次之間可被插隊
 
-crw4_automation = CRW4Factory.get_crw4_automation()
-mechanization = CRW4Mechanization(crw4_automation)
-algorithom = CRW4Algorithm(mechanization)
+def run_coalesced(kind, func, cas_list, id, refresh=False):
+    """
+    以 CAS 集合為 key 送出 /auto、/check，同時送出相同集合的請求只會執行一次；
+    合併的 /check 在完成後由回應快取以自己的 id 寫出結果，
+    /auto (automate_chart) 不使用回應快取，以自己的 id 再執行一次，由已儲存的配對結果組成圖表
+    """
+    key = mechanization.request_key(kind, cas_list)
+    result = scheduler.submit(INTERACTIVE, func, cas_list=cas_list, id=id, refresh=refresh, key=key, label=f"{kind} {id}").result()
+    if result.get("id") != id:
+        own = None
+        if kind == "check":
+            checked = preflight(cas_list)
+            own = scheduler.submit(INTERACTIVE, mechanization.cached_response, kind, mechanization.cache_key(kind, checked), id, label=f"{kind} {id} (合併)").result()
+        if own is None:
+            # 沒有回應快取可用時以自己的 id 再執行一次 (此時結果都已在快取/配對結果中，不需操作 GUI)
+            own = scheduler.submit(INTERACTIVE, func, cas_list=cas_list, id=id, label=f"{kind} {id} (合併)").result()
+        return own
+    return result
 
 @api.route("/auto")
 class Auto(Resource):
@@ -25,7 +64,8 @@ class Auto(Resource):
         cas_list = data.get("cas_list")
         id = data.get("id")
         try:
-            result = mechanization.automate(cas_list=cas_list, id=id)
+            refresh = bool(data.get("refresh", False))
+            result = run_coalesced("auto", mechanization.automate_chart, cas_list, id, refresh)
             return {'status': 0, "result": result}
         except Exception as e:
             return {"status": 1, "result": e.args[0], "error": e.__class__.__name__}
@@ -40,7 +80,7 @@ class DailyAppend(Resource):
         cas_list = data.get("cas_list")
         id = data.get("id")
         try:
-            result = algorithom.daily_algrthom()
+            result = scheduler.submit(DAILY, algorithom.daily_algrthom, label=f"daily {id}", key="daily").result()
             return {'status': 0, "result": result}
         except Exception as e:
             return {"status": 1, "result": e.args[0], "error": e.__class__.__name__}
@@ -56,11 +96,186 @@ class Check(Resource):
         cas_list = data.get("cas_list")
         id = data.get("id")
         try:
-            result = mechanization.automate_check(cas_list=cas_list, id=id)
+            refresh = bool(data.get("refresh", False))
+            result = run_coalesced("check", mechanization.automate_check, cas_list, id, refresh)
+            return {'status': 0, "result": result}
+        except Exception as e:
+            return {"status": 1, "result": e.args[0], "error": e.__class__.__name__}
+
+@api.route("/backfill")
+class Backfill(Resource):
+    @handle_request_exception
+    @api.marshal_with(general_output_payload)
+    def post(self):
+        try:
+            # 排程本身也需要操作 CRW4 (取得反應基團)，因此同樣以 BACKFILL 等級排隊，不等待完成
+            scheduler.submit(BACKFILL, algorithom.queue_backfill, scheduler, label="plan backfill", key="plan backfill")
+            return {'status': 0, "result": "回補排程已送出"}
+        except Exception as e:
+            return {"status": 1, "result": e.args[0], "error": e.__class__.__name__}
+
+@api.route("/scheduler_stats")
+class SchedulerStats(Resource):
+    @handle_request_exception
+    @api.marshal_with(general_output_payload)
+    def get(self):
+        return {'status': 0, "result": scheduler.stats()}
+
+@api.route("/element_stats")
+class ElementStats(Resource):
+    @handle_request_exception
+    @api.marshal_with(general_output_payload)
+    def get(self):
+        return {'status': 0, "result": crw4_automation.elements.stats()}
+
+@api.route("/negative_cache/purge")
+class NegativeCachePurge(Resource):
+    @handle_request_exception
+    @api.expect(cas_list_payload)
+    @api.marshal_with(general_output_payload)
+    def post(self):
+        """清除找不到資料快取；cas_list 為空時全部清除"""
+        data = api.payload or {}
+        cas_list = data.get("cas_list") or None
+        try:
+            count = mechanization.purge_negative_cache(cas_list)
+            return {'status': 0, "result": f"已清除 {count} 筆"}
+        except Exception as e:
+            return {"status": 1, "result": e.args[0], "error": e.__class__.__name__}
+
+@api.route("/resolutions")
+class Resolutions(Resource):
+    @handle_request_exception
+    @api.marshal_with(general_output_payload)
+    def get(self):
+        """列出已選擇的複數結果與仍待操作人員選擇的 CAS"""
+        try:
+            result = mechanization.resolution_summary()
             return {'status': 0, "result": result}
         except Exception as e:
             return {"status": 1, "result": e.args[0], "error": e.__class__.__name__}
 
+    @handle_request_exception
+    @api.expect(resolution_payload)
+    @api.marshal_with(general_output_payload)
+    def post(self):
+        """操作人員指定複數結果要選取的化學品名稱"""
+        data = api.payload
+        cas = data.get("cas")
+        chemical_name = data.get("chemical_name")
+        try:
+            mechanization.choose_resolution(cas, chemical_name)
+            return {'status': 0, "result": f"cas:{cas} 將選取 {chemical_name}"}
+        except Exception as e:
+            return {"status": 1, "result": e.args[0], "error": e.__class__.__name__}
+
+@api.route("/catalog/harvest")
+class CatalogHarvest(Resource):
+    @handle_request_exception
+    @api.expect(cas_list_payload)
+    @api.marshal_with(general_output_payload)
+    def post(self):
+        """以 BACKFILL 等級補查化學品目錄 (寫入搜尋快取)；cas_list 為空時使用基礎與每日資料中的 CAS"""
+        data = api.payload or {}
+        cas_list = data.get("cas_list") or None
+        try:
+            scheduler.submit(BACKFILL, mechanization.harvest_catalog, cas_list, label="harvest catalog", key=None if cas_list else "harvest catalog")
+            return {'status': 0, "result": "目錄收集已送出"}
+        except Exception as e:
+            return {"status": 1, "result": e.args[0], "error": e.__class__.__name__}
+
+def run_backlog_ingest():
+    try:
+        mechanization.ingest_backlog(scheduler)
+    except Exception as e:
+        logger.error(f"歷史 xlsx 匯入失敗: {e}")
+    finally:
+        backlog_lock.release()
+
+@api.route("/pairs/ingest")
+class PairsIngest(Resource):
+    @handle_request_exception
+    @api.marshal_with(general_output_payload)
+    def post(self):
+        """在背景重新解析 OUTPUT_PATH/xlsx 中的歷史輸出，每份以一個 BACKFILL 工作寫入配對結果"""
+        if not backlog_lock.acquire(blocking=False):
+            return {"status": 1, "result": "歷史 xlsx 匯入執行中", "error": "Busy"}
+        try:
+            threading.Thread(target=run_backlog_ingest, name="ingest backlog", daemon=True).start()
+            return {'status': 0, "result": "歷史 xlsx 匯入已送出"}
+        except Exception as e:
+            backlog_lock.release()
+            return {"status": 1, "result": e.args[0], "error": e.__class__.__name__}
+
+@api.route("/pairs/stats")
+class PairsStats(Resource):
+    @handle_request_exception
+    @api.marshal_with(general_output_payload)
+    def get(self):
+        return {'status': 0, "result": mechanization.pair_store.stats()}
+
+@api_hazard.route("/chemical/<string:cas>")
+class HazardChemical(Resource):
+    @handle_request_exception
+    @api_hazard.expect(hazard_query_parser)
+    @api_hazard.marshal_with(hazard_output_payload)
+    def get(self, cas):
+        """與 cas 有已計算結果的化學品 (不相容者優先)，可依相容性等級/危害類別篩選"""
+        args = hazard_query_parser.parse_args()
+        try:
+            result = mechanization.hazard_index.partners(normalize_cas(cas) or cas, args["hazard"], args["offset"], args["limit"])
+            if result is None:
+                return {"status": 1, "result": {"cas": cas}, "error": "尚未收錄此化學品的配對結果或已除役"}
+            return {'status': 0, "result": result}
+        except Exception as e:
+            return {"status": 1, "result": e.args[0], "error": e.__class__.__name__}
+
+@api_hazard.route("/pairs")
+class HazardPairs(Resource):
+    @handle_request_exception
+    @api_hazard.expect(hazard_query_parser)
+    @api_hazard.marshal_with(hazard_output_payload)
+    def get(self):
+        """符合任一相容性等級/危害類別的所有配對，例如 ?hazard=gas,heat"""
+        args = hazard_query_parser.parse_args()
+        try:
+            return {'status': 0, "result": mechanization.hazard_index.pairs(args["hazard"], args["offset"], args["limit"])}
+        except Exception as e:
+            return {"status": 1, "result": e.args[0], "error": e.__class__.__name__}
+
+@api_hazard.route("/stats")
+class HazardStats(Resource):
+    @handle_request_exception
+    @api_hazard.marshal_with(hazard_output_payload)
+    def get(self):
+        return {'status': 0, "result": mechanization.hazard_index.stats()}
+
+@api.route("/archive/<string:id>")
+class ArchiveHistory(Resource):
+    @handle_request_exception
+    @api.marshal_with(general_output_payload)
+    def get(self, id):
+        """批次 id 的所有匯出紀錄 (時間、內容雜湊、CAS 集合)"""
+        return {'status': 0, "result": export_archive().history(id)}
+
+@api.route("/archive/<string:id>/restore")
+class ArchiveRestore(Resource):
+    @handle_request_exception
+    @api.marshal_with(general_output_payload)
+    def post(self, id):
+        """將批次 id 最近一次的匯出還原至 OUTPUT_PATH/restored"""
+        restored = mechanization.archived_export(id)
+        if restored is None:
+            return {"status": 1, "result": f"批次 {id} 沒有封存紀錄", "error": "KeyError"}
+        return {'status': 0, "result": restored["path"]}
+
+@api.route("/catalog/stats")
+class CatalogStats(Resource):
+    @handle_request_exception
+    @api.marshal_with(general_output_payload)
+    def get(self):
+        return {'status': 0, "result": mechanization.catalog.stats()}
+
 @api.route("/test")
 class Test(Resource):
     @handle_request_exception
@@ -70,7 +285,7 @@ class Test(Resource):
         data = api.payload
         cas = data.get("cas")
         try:
-            result = mechanization.test(cas=cas)
+            result = scheduler.submit(INTERACTIVE, mechanization.test, cas=cas, label=f"test {cas}").result()
             return result
         except Exception as e:
             return {"status": 1, "result": e.args[0], "error": e.__class__.__name__}
@@ -84,7 +299,7 @@ class Add(Resource):
         data = api.payload
         cas = data.get("cas")
         try:
-            result = mechanization.test(cas=cas)
+            result = scheduler.submit(INTERACTIVE, mechanization.test, cas=cas, label=f"test {cas}").result()
             return result
         except Exception as e:
             return {"status": 1, "result": e.args[0], "error": e.__class__.__name__}
@@ -113,6 +328,7 @@ class Add(Resource):
 
 
 if __name__ == "__main__":
+    bootstrap()
     app.run(host="0.0.0.0", port="5000", debug=False, use_reloader=False)
 
 
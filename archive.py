@@ -0,0 +1,142 @@
+import hashlib
+import io
+import json
+import lzma
+import os
+import threading
+import time
+import zipfile
+
+from logger import logger
+
+
+def content_hash(path):
+    """
+    xlsx 內容的 sha256：依成員名稱排序後雜湊各成員內容，略過 docProps/ (建立/修改時間等中繼資料)，
+    同一份結果在不同時間匯出會得到相同的雜湊；不是 zip 時雜湊整個檔案
+    """
+    digest = hashlib.sha256()
+    try:
+        with zipfile.ZipFile(path) as workbook:
+            for name in sorted(workbook.namelist()):
+                if name.startswith("docProps/"):
+                    continue
+                digest.update(name.encode("utf-8") + b"\0")
+                digest.update(workbook.read(name))
+    except zipfile.BadZipFile:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def _pack(path):
+    """xlsx 各成員已各自以 deflate 壓縮，先改為不壓縮重新封裝，再整體以 lzma 壓縮 (跨成員的重複內容才能被壓縮)"""
+    try:
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(path) as source, zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as stored:
+            for info in source.infolist():
+                stored.writestr(info, source.read(info.filename), compress_type=zipfile.ZIP_STORED)
+        data = buffer.getvalue()
+    except zipfile.BadZipFile:
+        with open(path, 'rb') as f:
+            data = f.read()
+    return lzma.compress(data)
+
+def _unpack(blob, destination):
+    data = lzma.decompress(blob)
+    tmp_path = destination + ".tmp"
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as stored, zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as target:
+            for info in stored.infolist():
+                target.writestr(info, stored.read(info.filename), compress_type=zipfile.ZIP_DEFLATED)
+    except zipfile.BadZipFile:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+    os.replace(tmp_path, destination)
+
+
+class ExportArchive:
+    """
+    CRW4 匯出 xlsx 的內容定址封存，存放在 directory 下：
+    - blobs/{雜湊前兩碼}/{雜湊}.xlsx.xz：每份不同的結果只存一次 (雜湊見 content_hash)
+    - manifest.jsonl：每次匯出一行 {"id", "time", "blob", "cas", "size"}，只會附加
+    同一批次重複執行、或不同批次得到相同結果都只增加 manifest 的一行；manifest 啟動時載入為 id → 執行紀錄的索引
+    """
+    MANIFEST_FILE = "manifest.jsonl"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, self.MANIFEST_FILE)
+        self.runs = {}   # id → [執行紀錄, ...] (依時間先後)
+        self.blobs = {}  # 雜湊 → 壓縮後大小
+        self.lock = threading.RLock()  # 排程器 worker 封存、API 執行緒查詢/還原
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        self._index(json.loads(line))
+                    except json.JSONDecodeError:
+                        logger.warning(f"略過 {self.manifest_path} 中無法解析的一行")
+
+    def _index(self, entry):
+        self.runs.setdefault(entry["id"], []).append(entry)
+        self.blobs[entry["blob"]] = entry["size"]
+
+    def _blob_path(self, digest):
+        return os.path.join(self.directory, "blobs", digest[:2], f"{digest}.xlsx.xz")
+
+    def put(self, id, path, cas_list=None):
+        """封存一次匯出，內容已存在時只新增 manifest 紀錄；回傳該筆紀錄"""
+        with self.lock:
+            digest = content_hash(path)
+            blob_path = self._blob_path(digest)
+            if os.path.exists(blob_path):
+                size = os.path.getsize(blob_path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                tmp_path = blob_path + ".tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(_pack(path))
+                os.replace(tmp_path, blob_path)
+                size = os.path.getsize(blob_path)
+                logger.info(f"封存 {id} 的匯出結果 {digest[:12]} ({os.path.getsize(path)} -> {size} bytes)")
+            entry = {"id": id, "time": time.strftime("%Y-%m-%d %H:%M:%S"), "blob": digest, "cas": sorted(set(cas_list or [])), "size": size}
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.manifest_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._index(entry)
+            return entry
+
+    def history(self, id):
+        """批次 id 的所有執行紀錄 (依時間先後)"""
+        with self.lock:
+            return list(self.runs.get(id, []))
+
+    def latest(self, id):
+        with self.lock:
+            runs = self.runs.get(id)
+            return runs[-1] if runs else None
+
+    def find(self, cas_list):
+        """CAS 集合完全相同的執行紀錄"""
+        with self.lock:
+            cas = sorted(set(cas_list))
+            return [entry for runs in self.runs.values() for entry in runs if entry["cas"] == cas]
+
+    def restore(self, digest, destination):
+        """將封存的結果還原為 xlsx，回傳 destination"""
+        with self.lock:
+            with open(self._blob_path(digest), 'rb') as f:
+                _unpack(f.read(), destination)
+            return destination
+
+    def stats(self):
+        with self.lock:
+            return {
+                "batches": len(self.runs),
+                "runs": sum(len(runs) for runs in self.runs.values()),
+                "blobs": len(self.blobs),
+                "bytes": sum(self.blobs.values()),
+            }
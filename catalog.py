@@ -0,0 +1,41 @@
+class CatalogSnapshot:
+    """
+    CRW4 化學品目錄的唯讀檢視，直接由搜尋快取 (LookupCache：一筆/複數筆) 與找不到資料快取 (NegativeCache) 組成，
+    本身不另外保存資料，清除快取或版本變更後目錄也跟著更新。
+    由 CRW4Mechanization.harvest_catalog 透過既有的搜尋流程補查尚未收錄的 CAS，/check 可以直接由目錄回答，不需操作 GUI
+    """
+    def __init__(self, lookup_cache, negative_cache):
+        self.lookup_cache = lookup_cache
+        self.negative_cache = negative_cache
+
+    def __contains__(self, cas):
+        return cas in self.negative_cache or cas in self.lookup_cache
+
+    def __len__(self):
+        with self.lookup_cache.lock, self.negative_cache.lock:
+            return len(self.lookup_cache.entries) + len(self.negative_cache.misses)
+
+    def pending(self, cas_list):
+        """尚未收錄的 CAS (保留順序並去除重複)"""
+        return [cas for cas in dict.fromkeys(cas_list) if cas not in self]
+
+    def check_item(self, cas):
+        """組成與 CRW4Automation.multiple_check 每筆結果相同格式的資料"""
+        if cas in self.negative_cache:
+            return self.negative_cache.check_item(cas)
+        return self.lookup_cache.check_item(cas)
+
+    def answer(self, cas_list):
+        """回傳 (目錄中已有的 multiple_check 格式結果, 未收錄的 CAS)"""
+        items = [self.check_item(cas) for cas in cas_list if cas in self]
+        unknown = [cas for cas in cas_list if cas not in self]
+        return items, unknown
+
+    def stats(self):
+        with self.lookup_cache.lock, self.negative_cache.lock:
+            counts = {"found": 0, "miss": len(self.negative_cache.misses), "muiltiple": 0}
+            for cas, entry in self.lookup_cache.entries.items():
+                if cas not in self.negative_cache:
+                    counts["found" if entry["status"] == 0 else "muiltiple"] += 1
+        total = counts["found"] + counts["miss"] + counts["muiltiple"]
+        return {"version": self.lookup_cache.version, "total": total, **counts}
@@ -0,0 +1,124 @@
+import json
+import os
+
+from logger import logger
+from planner import delta_operations, order_batches
+
+
+def record_timing(path, record):
+    """將一次批次執行的各階段耗時 (秒) 追加到 timings.jsonl"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def read_timings(path):
+    """讀取過去的執行耗時紀錄"""
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return records
+
+class CostModel:
+    """
+    CRW4 批次執行時間模型 (秒)：
+    - add_mixture / clear_mixture：每次固定耗時
+    - add_chemical / remove_chemical：每筆化學品固定耗時
+    - export：輸出圖表與等待 xlsx，隨化合物大小線性成長 export_base + export_per_chemical * n
+    沒有紀錄時使用預設值
+    """
+    DEFAULTS = {
+        "add_mixture": 3.0,
+        "add_chemical": 6.0,
+        "remove_chemical": 4.0,
+        "export_base": 30.0,
+        "export_per_chemical": 0.3,
+        "clear_mixture": 20.0,
+    }
+
+    def __init__(self, params=None):
+        self.params = dict(self.DEFAULTS)
+        self.params.update(params or {})
+
+    @classmethod
+    def fit(cls, records):
+        """由 timings.jsonl 的紀錄擬合各項參數"""
+        params = {}
+
+        def mean(key):
+            values = [r[key] for r in records if r.get(key) is not None]
+            return sum(values) / len(values) if values else None
+
+        for key in ("add_mixture", "clear_mixture"):
+            value = mean(key)
+            if value is not None:
+                params[key] = value
+
+        for key, count in (("add_chemical", "adds"), ("remove_chemical", "removes")):
+            total = sum(r[key] for r in records if r.get(key) is not None and r.get(count))
+            n = sum(r[count] for r in records if r.get(key) is not None and r.get(count))
+            if n:
+                params[key] = total / n
+
+        # export 時間對化合物大小做最小平方法直線擬合
+        points = [(r["size"], r["export"]) for r in records if r.get("export") is not None and r.get("size")]
+        if points:
+            n = len(points)
+            mean_x = sum(x for x, _ in points) / n
+            mean_y = sum(y for _, y in points) / n
+            var_x = sum((x - mean_x) ** 2 for x, _ in points)
+            slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x if var_x else 0.0
+            slope = max(slope, 0.0)
+            params["export_per_chemical"] = slope
+            params["export_base"] = max(mean_y - slope * mean_x, 0.0)
+
+        logger.debug(f"由 {len(records)} 筆紀錄擬合執行時間模型: {params}")
+        return cls(params)
+
+    @classmethod
+    def from_file(cls, path):
+        return cls.fit(read_timings(path))
+
+    def export_time(self, size):
+        return self.params["export_base"] + self.params["export_per_chemical"] * size
+
+    def estimate(self, batches, delta=False):
+        """
+        dry-run：估算執行 batches ({batch_name: [cas, ...]}) 所需的操作次數與總時間，不會操作 CRW4
+        delta=True 時以增量方式估算 (只建立一次化合物，只新增/移除有變動的化學品)，
+        並與 automate_delta 一樣先以 order_batches 排序
+        """
+        p = self.params
+        if delta:
+            batches = order_batches(batches)
+        sizes = [len(set(batch)) for batch in batches.values()]
+        exports = len(batches)
+        if delta:
+            ops = delta_operations(batches)
+            adds, removes = ops["delta_adds"], ops["delta_removes"]
+            mixtures = clears = 1 if batches else 0
+        else:
+            adds, removes = sum(sizes), 0
+            mixtures = clears = exports
+
+        seconds = (
+            mixtures * p["add_mixture"]
+            + adds * p["add_chemical"]
+            + removes * p["remove_chemical"]
+            + sum(self.export_time(size) for size in sizes)
+            + clears * p["clear_mixture"]
+        )
+        return {
+            "runs": exports,
+            "add_mixture": mixtures,
+            "add_chemical": adds,
+            "remove_chemical": removes,
+            "exports": exports,
+            "clear_mixture": clears,
+            "seconds": round(seconds, 1),
+            "hours": round(seconds / 3600, 2),
+        }
@@ -0,0 +1,232 @@
+import json
+import os
+
+import numpy as np
+
+from logger import logger
+
+
+def pair_position(i, j):
+    """上三角 (i < j) 配對在位元陣列中的位置，與化學品總數無關，新增化學品時不需重排"""
+    return j * (j - 1) // 2 + i
+
+def pair_indices(position):
+    """pair_position 的反函數，回傳 (i, j) (可傳入 numpy 陣列)"""
+    position = np.asarray(position, dtype=np.int64)
+    j = ((1 + np.sqrt(1 + 8 * position.astype(np.float64))) // 2).astype(np.int64)
+    # 浮點誤差修正
+    j = np.where(j * (j - 1) // 2 > position, j - 1, j)
+    j = np.where((j + 1) * j // 2 <= position, j + 1, j)
+    return position - j * (j - 1) // 2, j
+
+class PairCoverage:
+    """
+    已計算配對的持久化索引：
+    - coverage_index.json 紀錄 CAS → index 的順序與已覆蓋配對數
+    - coverage.bits 為以 memmap 開啟的位元陣列，每個不重複配對 1 bit
+    一萬筆化學品約 6 MB，三萬筆約 56 MB，不需整個載入記憶體
+    """
+    INDEX_FILE = "coverage_index.json"
+    BITS_FILE = "coverage.bits"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, self.INDEX_FILE)
+        self.bits_path = os.path.join(directory, self.BITS_FILE)
+        self.cas_list = []
+        self.covered = 0    # 未除役化學品之間已覆蓋的配對數
+        self.retired = set()
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.cas_list = data.get("cas", [])
+            self.covered = data.get("covered", 0)
+            self.retired = set(data.get("retired", []))
+        self.index = {cas: i for i, cas in enumerate(self.cas_list)}
+        self._bits = None
+
+    # ---- 檔案處理 ----
+    def _bits_size(self, count):
+        return (count * (count - 1) // 2 + 7) // 8
+
+    def _open_bits(self):
+        """依目前化學品數量開啟 (必要時擴充) 位元檔"""
+        needed = self._bits_size(len(self.cas_list))
+        current = os.path.getsize(self.bits_path) if os.path.exists(self.bits_path) else 0
+        if self._bits is not None and current >= needed:
+            return self._bits
+        self._bits = None  # Windows 需先釋放 memmap 才能改變檔案大小
+        if current < needed:
+            os.makedirs(self.directory, exist_ok=True)
+            # 每次至少擴充一倍，避免每筆新增都重開檔案
+            size = max(needed, current * 2, 4096)
+            with open(self.bits_path, 'ab') as f:
+                f.truncate(size)
+            current = size
+        self._bits = np.memmap(self.bits_path, dtype=np.uint8, mode='r+', shape=(current,))
+        return self._bits
+
+    def flush(self):
+        """將位元檔與索引寫回磁碟"""
+        if self._bits is not None:
+            self._bits.flush()
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"cas": self.cas_list, "covered": self.covered, "retired": sorted(self.retired)}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    # ---- 索引 ----
+    def add_chemicals(self, cas_list):
+        """替尚未收錄的 CAS 配發 index，回傳每筆 CAS 的 index 陣列"""
+        for cas in cas_list:
+            if cas not in self.index:
+                self.index[cas] = len(self.cas_list)
+                self.cas_list.append(cas)
+        return np.array([self.index[cas] for cas in cas_list], dtype=np.int64)
+
+    def _positions(self, indices):
+        """回傳 indices 內所有不重複配對的位元位置"""
+        indices = np.unique(indices)
+        if len(indices) < 2:
+            return np.empty(0, dtype=np.int64)
+        rows, cols = np.triu_indices(len(indices), k=1)
+        return pair_position(indices[rows], indices[cols])
+
+    def _read(self, positions):
+        """讀取各位置是否已覆蓋"""
+        known = positions < len(self.cas_list) * (len(self.cas_list) - 1) // 2
+        result = np.zeros(len(positions), dtype=bool)
+        if not os.path.exists(self.bits_path) or not known.any():
+            return result
+        bits = self._open_bits()
+        pos = positions[known]
+        result[known] = (bits[pos >> 3] >> (pos & 7).astype(np.uint8)) & 1 == 1
+        return result
+
+    def _active_indices(self):
+        return np.array([i for i, cas in enumerate(self.cas_list) if cas not in self.retired], dtype=np.int64)
+
+    def _covered_with(self, index, others):
+        """index 與 others 之間已覆蓋的配對數"""
+        others = others[others != index]
+        if not len(others):
+            return 0
+        positions = pair_position(np.minimum(others, index), np.maximum(others, index))
+        return int(self._read(positions).sum())
+
+    # ---- 操作 ----
+    def retire(self, cas_list):
+        """
+        除役化學品：保留已計算的配對位元 (之後復用不需重算)，
+        但不再計入統計，回傳實際除役的 CAS
+        """
+        retired = []
+        for cas in dict.fromkeys(cas_list):
+            if cas not in self.index or cas in self.retired:
+                continue
+            self.retired.add(cas)
+            self.covered -= self._covered_with(self.index[cas], self._active_indices())
+            retired.append(cas)
+        if retired:
+            self.flush()
+            logger.info(f"配對索引除役 {len(retired)} 筆化學品")
+        return retired
+
+    def restore(self, cas_list):
+        """恢復已除役的化學品，先前計算過的配對直接沿用"""
+        restored = []
+        for cas in dict.fromkeys(cas_list):
+            if cas not in self.retired:
+                continue
+            self.retired.discard(cas)
+            self.covered += self._covered_with(self.index[cas], self._active_indices())
+            restored.append(cas)
+        if restored:
+            self.flush()
+        return restored
+
+    def mark_batch(self, cas_list, known=None):
+        """
+        將一份已計算結果 (批次或匯出檔) 內的所有配對標記為已計算，回傳新增的配對數。
+        known 為與 cas_list 對應的 (n, n) 布林矩陣，指定時只標記其中為 True 的配對 (例如有結果的配對)。
+        不會恢復其中已除役的化學品 (由 restore 決定)，與除役化學品的配對會保留但不計入統計
+        """
+        indices = self.add_chemicals(list(cas_list))
+        if known is None:
+            positions = self._positions(indices)
+        else:
+            rows, cols = np.triu_indices(len(indices), k=1)
+            keep = (known[rows, cols] | known[cols, rows]) & (indices[rows] != indices[cols])
+            low = np.minimum(indices[rows][keep], indices[cols][keep])
+            high = np.maximum(indices[rows][keep], indices[cols][keep])
+            positions = np.unique(pair_position(low, high))
+        if not len(positions):
+            self.flush()
+            return 0
+        bits = self._open_bits()
+        new_positions = positions[~self._read(positions)]
+        np.bitwise_or.at(bits, new_positions >> 3, (1 << (new_positions & 7)).astype(np.uint8))
+        added = len(new_positions)
+        if self.retired and added:
+            retired = np.array([self.index[cas] for cas in self.retired], dtype=np.int64)
+            rows, cols = pair_indices(new_positions)
+            added = int((~(np.isin(rows, retired) | np.isin(cols, retired))).sum())
+        self.covered += added
+        self.flush()
+        logger.debug(f"配對索引新增 {len(new_positions)} 筆配對，累計 {self.covered} 筆")
+        return len(new_positions)
+
+    def is_covered(self, cas_a, cas_b):
+        """兩個 CAS 的配對是否已計算過"""
+        if cas_a == cas_b:
+            return True
+        if cas_a not in self.index or cas_b not in self.index:
+            return False
+        i, j = sorted((self.index[cas_a], self.index[cas_b]))
+        return bool(self._read(np.array([pair_position(i, j)], dtype=np.int64))[0])
+
+    def uncovered_pairs(self, cas_list):
+        """回傳 cas_list 內尚未計算的配對 [(cas_a, cas_b), ...]"""
+        cas_list = list(dict.fromkeys(cas_list))
+        known = [cas for cas in cas_list if cas in self.index]
+        unknown = [cas for cas in cas_list if cas not in self.index]
+
+        missing = []
+        if len(known) > 1:
+            indices = np.array(sorted(self.index[cas] for cas in known), dtype=np.int64)
+            rows, cols = np.triu_indices(len(indices), k=1)
+            covered = self._read(pair_position(indices[rows], indices[cols]))
+            for i, j in zip(rows[~covered], cols[~covered]):
+                missing.append((self.cas_list[indices[i]], self.cas_list[indices[j]]))
+        for n, cas in enumerate(unknown):
+            missing.extend((other, cas) for other in known + unknown[:n])
+        return missing
+
+    def missing_count(self, cas_list=None):
+        """尚未計算的配對數；未指定 cas_list 時為索引內所有化學品，O(1)"""
+        if cas_list is None:
+            count = len(self.cas_list) - len(self.retired)
+            return count * (count - 1) // 2 - self.covered
+        cas_list = list(dict.fromkeys(cas_list))
+        known = np.array([self.index[cas] for cas in cas_list if cas in self.index], dtype=np.int64)
+        total = len(cas_list) * (len(cas_list) - 1) // 2
+        covered = 0
+        known.sort()
+        # 逐列計算，避免一次產生所有配對的位置
+        for n in range(1, len(known)):
+            covered += int(self._read(pair_position(known[:n], known[n])).sum())
+        return total - covered
+
+    def stats(self, cas_list=None):
+        """配對覆蓋統計"""
+        count = len(self.cas_list) - len(self.retired) if cas_list is None else len(set(cas_list))
+        pairs = count * (count - 1) // 2
+        missing = self.missing_count(cas_list)
+        return {
+            "chemicals": count,
+            "pairs": pairs,
+            "covered": pairs - missing,
+            "missing": missing,
+            "ratio": round((pairs - missing) / pairs, 4) if pairs else 1.0,
+        }
@@ -1,5 +1,8 @@
 import json
-from app import mechanization
+import app
+
+app.bootstrap()
+mechanization = app.mechanization
 from logger import logger
 
 def split_list(data, chunk_size):
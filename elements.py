@@ -0,0 +1,58 @@
+from logger import logger
+
+
+class ElementCache:
+    """
+    CRW4 主視窗中固定控制項 (搜尋欄、Search 按鈕、搜尋結果欄等) 的 wrapper 快取。
+    child_window(...) 每次都會在 UIA 樹中重新搜尋，快取解析後的 wrapper 可省下每筆化學品的搜尋時間；
+    取用前以 is_visible() 便宜地確認仍有效，失效 (已被關閉或重建) 時才重新解析。
+    root 只需要提供 child_window(**criteria).wrapper_object()，因此可以用假的視窗樹測試
+    """
+    def __init__(self, root):
+        self.root = root
+        self._elements = {}
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    @staticmethod
+    def _key(criteria):
+        return tuple(sorted(criteria.items()))
+
+    def _valid(self, wrapper):
+        try:
+            return bool(wrapper.is_visible())
+        except Exception:
+            return False
+
+    def get(self, **criteria):
+        """回傳符合 criteria 的控制項 wrapper (參數與 child_window 相同)"""
+        key = self._key(criteria)
+        wrapper = self._elements.get(key)
+        if wrapper is not None:
+            if self._valid(wrapper):
+                self.hits += 1
+                return wrapper
+            self.stale += 1
+            logger.debug(f"控制項 {criteria} 已失效，重新解析")
+        self.misses += 1
+        wrapper = self.root.child_window(**criteria).wrapper_object()
+        self._elements[key] = wrapper
+        return wrapper
+
+    def invalidate(self, **criteria):
+        """移除指定的控制項，未指定時清除全部 (例如 CRW4 重新啟動)"""
+        if criteria:
+            self._elements.pop(self._key(criteria), None)
+        else:
+            self._elements.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "cached": len(self._elements),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,30 @@
+import os
+
+from openpyxl import Workbook
+
+from hazard import cell_text
+from logger import logger
+
+# 與 CRW4 Export Chart Data (加上 output_chart_to_csv 移入的 ::CASNum 欄位) 相同的欄位名稱
+NAME_HEADER = "ChemName"
+CAS_HEADER = "ChartMixInfoLink::CASNum"
+
+
+def write_export(path, cas_list, names, row_codes):
+    """
+    以 openpyxl write-only 模式逐列寫出 CRW_Data_Export.xlsx 格式的相容性圖表 (可由 pairs.read_export 讀回)：
+    第一列為 ChemName、各化學品名稱、ChartMixInfoLink::CASNum；之後每個化學品一列。
+    row_codes(cas) 回傳該化學品與 cas_list 中各化學品的代碼，每次只取一列，記憶體用量與化學品數無關
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp.xlsx"
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("CRW_Data_Export")
+    sheet.append([NAME_HEADER] + list(names) + [CAS_HEADER])
+    for i, (cas, name) in enumerate(zip(cas_list, names)):
+        codes = row_codes(cas)
+        sheet.append([name] + ["" if j == i else cell_text(code) for j, code in enumerate(codes)] + [cas])
+    workbook.save(tmp_path)
+    os.replace(tmp_path, path)
+    logger.info(f"已輸出 {len(cas_list)} 筆化學品的相容性圖表至 {path}")
+    return path
@@ -0,0 +1,100 @@
+"""
+CRW4 相容性圖表單一配對的結果以 1 byte (uint8) 表示：
+- bit 0~1：相容性 0=尚未計算 1=相容 (Y) 2=注意 (C) 3=不相容 (N)
+- bit 2~7：危害類別旗標 (可同時多個)
+"""
+import re
+
+UNKNOWN = 0
+COMPATIBLE = 1
+CAUTION = 2
+INCOMPATIBLE = 3
+COMPATIBILITY_MASK = 0b11
+COMPATIBILITY_NAMES = {UNKNOWN: "unknown", COMPATIBLE: "compatible", CAUTION: "caution", INCOMPATIBLE: "incompatible"}
+
+# 危害類別 → 旗標
+CATEGORIES = {
+    "heat": 1 << 2,       # 放熱 (含聚合反應)
+    "gas": 1 << 3,        # 產生氣體/加壓
+    "toxic": 1 << 4,      # 產生有毒氣體
+    "flammable": 1 << 5,  # 產生可燃氣體
+    "fire": 1 << 6,       # 起火
+    "explosive": 1 << 7,  # 劇烈或爆炸性反應
+}
+
+# 圖表儲存格中的簡寫代碼
+_CODES = {
+    "H": ("heat",),
+    "P": ("heat",),
+    "G": ("gas",),
+    "GT": ("gas", "toxic"),
+    "GF": ("gas", "flammable"),
+    "F": ("fire",),
+    "E": ("explosive",),
+}
+# 圖表儲存格中的危害敘述關鍵字
+_KEYWORDS = (
+    ("EXOTHERM", "heat"), ("HEAT", "heat"), ("POLYMERI", "heat"),
+    ("GAS", "gas"), ("PRESSURI", "gas"),
+    ("TOXIC", "toxic"),
+    ("FLAMMABLE", "flammable"),
+    ("FIRE", "fire"),
+    ("EXPLOS", "explosive"), ("INTENSE", "explosive"),
+)
+_TOKEN = re.compile(r"[A-Z]+")
+
+
+def encode_cell(text):
+    """將圖表儲存格的文字 (例如 "N", "C: GT", "Incompatible - May produce toxic gases") 轉成 uint8 代碼"""
+    if text is None:
+        return UNKNOWN
+    text = str(text).strip().upper()
+    if not text:
+        return UNKNOWN
+    tokens = _TOKEN.findall(text)
+    first = tokens[0] if tokens else ""
+    if "INCOMPATIBLE" in text or "NOT COMPATIBLE" in text or first == "N":
+        code = INCOMPATIBLE
+    elif "CAUTION" in text or first == "C":
+        code = CAUTION
+    elif "COMPATIBLE" in text or first == "Y":
+        code = COMPATIBLE
+    else:
+        return UNKNOWN
+    for token in tokens[1:]:
+        for category in _CODES.get(token, ()):
+            code |= CATEGORIES[category]
+    for keyword, category in _KEYWORDS:
+        if keyword in text:
+            code |= CATEGORIES[category]
+    return code
+
+def compatibility(code):
+    return int(code) & COMPATIBILITY_MASK
+
+def categories(code):
+    """代碼中的危害類別名稱列表"""
+    return [name for name, flag in CATEGORIES.items() if int(code) & flag]
+
+def decode(code):
+    """{"compatibility": "incompatible", "hazards": ["gas", "toxic"]}"""
+    return {"compatibility": COMPATIBILITY_NAMES[compatibility(code)], "hazards": categories(code)}
+
+def cell_text(code):
+    """還原為圖表儲存格的簡寫文字 (例如 "N: GT")，供輸出 CRW4 格式使用"""
+    level = compatibility(code)
+    if level == UNKNOWN:
+        return ""
+    letter = {COMPATIBLE: "Y", CAUTION: "C", INCOMPATIBLE: "N"}[level]
+    hazards = set(categories(code))
+    codes = []
+    if "toxic" in hazards:
+        codes.append("GT")
+    if "flammable" in hazards:
+        codes.append("GF")
+    if "gas" in hazards and not hazards & {"toxic", "flammable"}:
+        codes.append("G")
+    for name, short in (("heat", "H"), ("fire", "F"), ("explosive", "E")):
+        if name in hazards:
+            codes.append(short)
+    return f"{letter}: {' '.join(codes)}" if codes else letter
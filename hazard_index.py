@@ -0,0 +1,161 @@
+import numpy as np
+
+from coverage import pair_indices
+from hazard import CATEGORIES, CAUTION, COMPATIBILITY_MASK, COMPATIBLE, INCOMPATIBLE, decode
+from logger import logger
+
+# 相容性等級 → 代碼
+LEVELS = {"incompatible": INCOMPATIBLE, "caution": CAUTION, "compatible": COMPATIBLE}
+MAX_LIMIT = 1000
+
+
+def _matches(key, codes):
+    """codes 中符合 key (相容性等級或危害類別) 的布林陣列"""
+    if key in LEVELS:
+        return (codes & COMPATIBILITY_MASK) == LEVELS[key]
+    return (codes & CATEGORIES[key]) != 0
+
+
+class HazardIndex:
+    """
+    PairStore 的反向索引，回答「哪些化學品與 X 不相容」與「哪些配對會產生氣體/放熱」：
+    - 依化學品：PairStore 本身以 CAS index 排列，直接讀出該化學品與所有化學品的代碼再篩選
+    - 依相容性等級/危害類別：每個 key 一個排序好的配對位置 (pair_position) 陣列，分頁只需切片
+    啟動時掃描一次資料檔建立，之後由 PairStore.listeners 在每次寫入時增量更新。
+    相容 (compatible) 的配對佔大多數，只提供依化學品篩選，不建立配對位置陣列以節省記憶體。
+    查詢與 PairStore 共用 store.lock，update 由 PairStore 在持有 lock 時呼叫。
+    coverage 中已除役 (coverage.retired) 的化學品仍保留在 PairStore (之後復用不需重算)，但查詢結果一律排除
+    """
+    KEYS = tuple(LEVELS) + tuple(CATEGORIES)
+    PAIR_KEYS = ("incompatible", "caution") + tuple(CATEGORIES)
+
+    def __init__(self, store, coverage=None):
+        self.store = store
+        self.coverage = coverage
+        self._positions = {}
+        self._unions = {}  # 多個 key 的聯集快取，寫入後作廢
+        self._active = {}  # 排除除役化學品後的配對位置快取，寫入或除役名單改變後作廢
+        self._retired_key = frozenset()
+        self._retired = np.zeros(0, dtype=np.int64)  # 除役化學品在 PairStore 中的 index
+        self.rebuild()
+        store.listeners.append(self.update)
+
+    def rebuild(self):
+        with self.store.lock:
+            codes = self.store.codes()
+            self._positions = {key: np.flatnonzero(_matches(key, codes)).astype(np.int64) for key in self.PAIR_KEYS}
+            self._unions = {}
+            self._active = {}
+            logger.info(f"危害索引建立完成: {self.stats()}")
+
+    def update(self, positions, values):
+        """PairStore 寫入後的增量更新 (同一配對的新值會取代舊值)"""
+        positions = np.asarray(positions, dtype=np.int64)
+        values = np.asarray(values, dtype=np.uint8)
+        for key in self.PAIR_KEYS:
+            current = self._positions[key]
+            if len(current):
+                current = current[~np.isin(current, positions)]
+            self._positions[key] = np.union1d(current, positions[_matches(key, values)])
+        self._unions = {}
+        self._active = {}
+
+    def _retired_indices(self):
+        """除役化學品的 index (除役名單改變時重建，並作廢排除後的配對位置快取)"""
+        retired = frozenset(self.coverage.retired) if self.coverage is not None else frozenset()
+        if retired != self._retired_key:
+            self._retired_key = retired
+            self._retired = np.array(sorted(self.store.index[cas] for cas in retired if cas in self.store.index), dtype=np.int64)
+            self._active = {}
+        return self._retired
+
+    @staticmethod
+    def _check_keys(keys, allowed):
+        """正規化 (去空白、小寫、去除空字串) 並檢查 key"""
+        keys = [key.strip().lower() for key in keys if key and key.strip()]
+        unknown = [key for key in keys if key not in allowed]
+        if unknown:
+            raise ValueError(f"未知的危害類別 {unknown}，可用: {list(allowed)}")
+        return keys
+
+    @staticmethod
+    def _page(offset, limit):
+        offset = max(int(offset), 0)
+        limit = min(max(int(limit), 0), MAX_LIMIT)
+        return offset, limit
+
+    def partners(self, cas, keys=(), offset=0, limit=100):
+        """
+        與 cas 有結果的化學品，依嚴重程度 (不相容 > 注意 > 相容) 排序；
+        keys 指定時只列出符合任一 key 的配對。cas 未收錄或已除役時回傳 None
+        """
+        with self.store.lock:
+            keys = self._check_keys(keys, self.KEYS)
+            offset, limit = self._page(offset, limit)
+            retired = self._retired_indices()
+            if cas in self._retired_key:
+                return None
+            codes = self.store.row_all(cas)
+            if codes is None:
+                return None
+            mask = codes != 0
+            mask[retired] = False
+            if keys:
+                mask &= np.logical_or.reduce([_matches(key, codes) for key in keys])
+            hits = np.flatnonzero(mask)
+            hits = hits[np.lexsort((hits, -(codes[hits] & COMPATIBILITY_MASK).astype(np.int16)))]
+            page = hits[offset:offset + limit]
+            return {
+                "cas": cas,
+                "total": int(len(hits)),
+                "offset": offset,
+                "limit": limit,
+                "items": [{"cas": self.store.cas_list[k], **decode(codes[k])} for k in page],
+            }
+
+    def _select(self, keys):
+        if len(keys) == 1:
+            return self._positions[keys[0]]
+        keys = tuple(sorted(set(keys)))
+        if keys not in self._unions:
+            self._unions[keys] = np.unique(np.concatenate([self._positions[key] for key in keys]))
+        return self._unions[keys]
+
+    def _select_active(self, keys):
+        """同 _select，但排除任一方已除役的配對"""
+        retired = self._retired_indices()
+        if not len(retired):
+            return self._select(keys)
+        keys = tuple(sorted(set(keys)))
+        if keys not in self._active:
+            positions = self._select(keys)
+            rows, cols = pair_indices(positions)
+            self._active[keys] = positions[~(np.isin(rows, retired) | np.isin(cols, retired))]
+        return self._active[keys]
+
+    def pairs(self, keys, offset=0, limit=100):
+        """符合任一 key 的所有配對 (依配對位置排序)"""
+        with self.store.lock:
+            keys = self._check_keys(keys, self.PAIR_KEYS)
+            if not keys:
+                raise ValueError(f"請指定危害類別，可用: {list(self.PAIR_KEYS)}")
+            offset, limit = self._page(offset, limit)
+            positions = self._select_active(keys)
+            page = positions[offset:offset + limit]
+            codes = self.store.codes()[page]
+            rows, cols = pair_indices(page)
+            cas_list = self.store.cas_list
+            return {
+                "keys": keys,
+                "total": int(len(positions)),
+                "offset": offset,
+                "limit": limit,
+                "items": [
+                    {"cas_a": cas_list[i], "cas_b": cas_list[j], **decode(code)}
+                    for i, j, code in zip(rows.tolist(), cols.tolist(), codes.tolist())
+                ],
+            }
+
+    def stats(self):
+        with self.store.lock:
+            return {key: int(len(self._select_active([key]))) for key in self.PAIR_KEYS}
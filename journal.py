@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import time
+
+
+def cas_set_hash(cas_list):
+    """CAS 集合 (不計順序與重複) 的雜湊，記在 mixture 步驟中，確認接續的是同一組化學品"""
+    return hashlib.sha256("\n".join(sorted(set(cas_list))).encode("utf-8")).hexdigest()[:16]
+
+
+class ExecutionJournal:
+    """
+    批次執行步驟的 append-only 紀錄 (journal.jsonl)，每完成一個步驟就寫入一行並 fsync：
+    mixture (建立化合物) → add (每筆化學品及其 status) → export (輸出圖表) → copy (複製 xlsx) → done
+    CRW4 中途當掉時可由 state() 取得最後確認完成的步驟，從該處接續而不需整批重跑。
+    mixture 步驟記錄 CAS 集合的雜湊 (cas_set_hash)，同一個批次名稱換了一組化學品時不應接續
+    """
+    STEPS = ("mixture", "add", "export", "copy", "done")
+
+    def __init__(self, path):
+        self.path = path
+
+    def record(self, batch, step, **data):
+        """寫入一個已完成的步驟"""
+        if step not in self.STEPS:
+            raise ValueError(f"未知的步驟: {step}")
+        entry = {"batch": batch, "step": step, "time": time.time(), **data}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def entries(self, batch=None):
+        if not os.path.exists(self.path):
+            return []
+        result = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # 寫到一半就當掉的最後一行視為未完成
+                    continue
+                if batch is None or entry["batch"] == batch:
+                    result.append(entry)
+        return result
+
+    def state(self, batch):
+        """
+        重播紀錄取得批次目前的進度：
+        {"mixture": bool, "cas_hash": mixture 記錄的 CAS 集合雜湊, "added": {cas: add 紀錄}, "exported": bool, "copied": bool, "xlsx": 複製的 xlsx 路徑, "done": bool}
+        重新建立化合物 (mixture) 會清掉先前的進度
+        """
+        state = {"mixture": False, "cas_hash": None, "added": {}, "exported": False, "copied": False, "xlsx": None, "done": False}
+        for entry in self.entries(batch):
+            step = entry["step"]
+            if step == "mixture":
+                state = {"mixture": True, "cas_hash": entry.get("cas_hash"), "added": {}, "exported": False, "copied": False, "xlsx": None, "done": False}
+            elif step == "add":
+                state["added"][entry["cas"]] = entry
+                state["exported"] = state["copied"] = False
+            elif step == "export":
+                state["exported"] = True
+            elif step == "copy":
+                state["copied"] = True
+                state["xlsx"] = entry.get("path")
+            elif step == "done":
+                state["done"] = True
+        return state
+
+    def incomplete(self):
+        """已開始但尚未完成的批次"""
+        started = {}
+        for entry in self.entries():
+            started[entry["batch"]] = entry["step"] == "done"
+        return [batch for batch, done in started.items() if not done]
@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+import time
+
+from logger import logger
+
+
+class LookupCache:
+    """
+    CAS → CRW4 搜尋結果的持久化快取 (lookup_cache.json)，以 CRW4 版本 (見 util.crw4_version) 區分：
+    {"version": "...", "entries": {cas: {"status": 0|1|2, "chemical_name": str 或 [候選名稱, ...]}}}
+    CRW4 資料庫是靜態的，同版本下同一個 CAS 的搜尋結果永遠相同；版本改變時整份快取作廢
+    找不到的 CAS (status 1) 另外由 NegativeCache 紀錄
+    """
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        self.entries = {}
+        self.lock = threading.RLock()  # 寫入與走訪 entries 時持有 (API 執行緒會直接讀取)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") == version:
+                self.entries = {cas: entry for cas, entry in data.get("entries", {}).items() if entry["status"] != 1}
+            else:
+                logger.warning(f"CRW4 版本已變更 ({data.get('version')} -> {version})，搜尋快取作廢")
+
+    def __contains__(self, cas):
+        return cas in self.entries
+
+    def get(self, cas):
+        return self.entries.get(cas)
+
+    def put(self, cas, status, chemical_name, save=True):
+        """紀錄一筆搜尋結果 (只接受 0=一筆 2=複數筆)"""
+        with self.lock:
+            if status not in (0, 2):
+                return
+            self.entries[cas] = {"status": status, "chemical_name": chemical_name}
+            if save:
+                self.save()
+
+    def put_search_result(self, cas, result, save=True):
+        """由 check_search_results 的回傳值紀錄"""
+        self.put(cas, result.get("status"), result.get("result", {}).get("chemical_name", ""), save)
+
+    def split(self, cas_list):
+        """回傳 (已快取的 CAS, 未快取的 CAS)"""
+        hits = [cas for cas in cas_list if cas in self.entries]
+        misses = [cas for cas in cas_list if cas not in self.entries]
+        return hits, misses
+
+    def statuses(self, cas_list, statuses):
+        """cas_list 中快取狀態屬於 statuses 的 CAS"""
+        return [cas for cas in cas_list if cas in self.entries and self.entries[cas]["status"] in statuses]
+
+    def check_item(self, cas):
+        """組成與 CRW4Automation.multiple_check 每筆結果相同格式的資料"""
+        entry = self.entries[cas]
+        status = entry["status"]
+        search_result = {"cas": cas, "chemical_name": entry["chemical_name"]}
+        if status == 2:
+            return {"cas": cas, "status": status, "result": {"result": search_result}}
+        return {"cas": cas, "status": status, "result": {"status": status, "result": search_result}}
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"version": self.version, "entries": self.entries}, f, ensure_ascii=False, indent=4)
+            os.replace(tmp_path, self.path)
+
+class NegativeCache:
+    """
+    搜尋結果為「0 chemicals found exactly matching」的 CAS (negative_cache.json)：
+    {"version": "...", "misses": {cas: 第一次確認找不到的時間}}
+    CRW4 版本改變時自動作廢，也可以用 purge() 手動清除
+    """
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        self.misses = {}
+        self.lock = threading.RLock()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") == version:
+                self.misses = data.get("misses", {})
+            else:
+                logger.warning(f"CRW4 版本已變更 ({data.get('version')} -> {version})，找不到資料快取作廢")
+
+    def __contains__(self, cas):
+        return cas in self.misses
+
+    def add(self, cas, save=True):
+        with self.lock:
+            if cas not in self.misses:
+                self.misses[cas] = time.strftime("%Y-%m-%d %H:%M:%S")
+                if save:
+                    self.save()
+
+    def purge(self, cas_list=None):
+        """清除指定 CAS (未指定則全部清除)，回傳清除筆數"""
+        with self.lock:
+            if cas_list is None:
+                count = len(self.misses)
+                self.misses = {}
+            else:
+                count = 0
+                for cas in cas_list:
+                    if self.misses.pop(cas, None) is not None:
+                        count += 1
+            self.save()
+            logger.info(f"已清除 {count} 筆找不到資料快取")
+            return count
+
+    def search_result(self, cas):
+        """與 check_search_results 找不到資料時相同的回傳值"""
+        return {"status": 1, "result": {"cas": cas, "chemical_name": ""}}
+
+    def check_item(self, cas):
+        """組成與 CRW4Automation.multiple_check 每筆結果相同格式的資料"""
+        return {"cas": cas, "status": 1, "result": self.search_result(cas)}
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"version": self.version, "misses": self.misses}, f, ensure_ascii=False, indent=4)
+            os.replace(tmp_path, self.path)
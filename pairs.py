@@ -0,0 +1,320 @@
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from openpyxl import load_workbook
+
+from coverage import pair_position
+from hazard import encode_cell
+from logger import logger
+
+
+def _layout(path, header):
+    """由標題列找出 CAS 欄位與圖表欄位的位置"""
+    if header is None:
+        raise ValueError(f"{path} 沒有資料")
+    columns = ["" if value is None else str(value).strip() for value in header]
+    cas_columns = [i for i, column in enumerate(columns) if column.endswith("CASNum")]
+    if not cas_columns:
+        raise ValueError(f"{path} 中找不到 ::CASNum 欄位")
+    cas_column = cas_columns[0]
+    chart_columns = [i for i, column in enumerate(columns) if i != cas_column and not column.upper().endswith("NAME")]
+    return cas_column, chart_columns
+
+def read_export(path):
+    """
+    以 openpyxl read-only 模式逐列讀取 CRW_Data_Export.xlsx，回傳 (cas_list, codes)；
+    codes 為 hazard.encode_cell 編碼後的 (n, n) uint8 矩陣，每列讀入後立即編碼，不保留儲存格文字。
+    版面：第一列為欄位名稱，每一列為化合物中的一個化學品；output_chart_to_csv 加入的 ::CASNum 欄位
+    (欄名以 CASNum 結尾) 為 CAS，欄名以 Name 結尾的為化學品名稱，其餘欄位依化合物順序為與各化學品的圖表結果
+    """
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        cas_column, chart_columns = _layout(path, next(rows, None))
+
+        cas_list = []
+        code_rows = []
+        for row in rows:
+            if len(row) <= cas_column or row[cas_column] is None or not str(row[cas_column]).strip():
+                continue
+            cas_list.append(str(row[cas_column]).strip())
+            code_rows.append(bytes(encode_cell(row[column]) if column < len(row) else 0 for column in chart_columns))
+    finally:
+        workbook.close()
+
+    n = len(cas_list)
+    if len(chart_columns) < n:
+        raise ValueError(f"{path} 的圖表欄位數 {len(chart_columns)} 少於化學品數 {n}")
+    codes = np.frombuffer(b"".join(code_rows), dtype=np.uint8).reshape(n, len(chart_columns))[:, :n].copy() if n else np.zeros((0, 0), dtype=np.uint8)
+    return cas_list, codes
+
+def verify_export(path, expected_cas):
+    """
+    確認匯出的 xlsx 確實是這個批次的結果 (而不是上一批留下的 CRW_Data_Export.xlsx)：
+    只串流讀取 CAS 欄位，比對 expected_cas (批次中成功加入的 CAS) 與圖表欄位數。
+    回傳 {"ok", "rows", "columns", "missing", "extra", "duplicates", "reason"}；無法解析時 ok 為 False
+    """
+    report = {"ok": False, "rows": 0, "columns": 0, "missing": [], "extra": [], "duplicates": [], "reason": ""}
+    try:
+        workbook = load_workbook(path, read_only=True, data_only=True)
+    except Exception as e:
+        report["reason"] = f"無法開啟: {e}"
+        return report
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        cas_column, chart_columns = _layout(path, next(rows, None))
+        exported = []
+        for row in rows:
+            if len(row) > cas_column and row[cas_column] is not None and str(row[cas_column]).strip():
+                exported.append(str(row[cas_column]).strip())
+    except Exception as e:
+        report["reason"] = str(e)
+        return report
+    finally:
+        workbook.close()
+
+    expected = set(expected_cas)
+    seen = set()
+    report["duplicates"] = sorted({cas for cas in exported if cas in seen or seen.add(cas)})
+    report["rows"], report["columns"] = len(exported), len(chart_columns)
+    report["missing"] = sorted(expected - seen)
+    report["extra"] = sorted(seen - expected)
+    problems = []
+    if report["missing"]:
+        problems.append(f"缺少 {len(report['missing'])} 筆")
+    if report["extra"]:
+        problems.append(f"多出 {len(report['extra'])} 筆")
+    if report["duplicates"]:
+        problems.append(f"重複 {len(report['duplicates'])} 筆")
+    if report["columns"] < report["rows"]:
+        problems.append(f"圖表欄位數 {report['columns']} 少於化學品數 {report['rows']}")
+    report["ok"] = not problems
+    report["reason"] = "，".join(problems)
+    return report
+
+def _parse_export(path):
+    """給 ProcessPoolExecutor 使用：回傳 (path, cas_list, codes, 錯誤訊息)"""
+    try:
+        cas_list, codes = read_export(path)
+        return path, cas_list, codes, None
+    except Exception as e:
+        return path, None, None, f"{e.__class__.__name__}: {e}"
+
+def parse_exports(paths, processes=None):
+    """
+    以多個子行程串流解析多份 xlsx，依完成順序 yield (path, cas_list, codes, 錯誤訊息)。
+    明確使用 spawn (CRW4 只在 Windows 上執行，行為與 Windows 相同)：子行程會以 __mp_main__ 重新匯入主程式，
+    主程式的啟動 (開啟 CRW4、排程器) 必須放在 if __name__ == "__main__" 之下
+    """
+    paths = list(paths)
+    if not paths:
+        return
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(_parse_export, path) for path in paths]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+class PairStore:
+    """
+    已計算配對的圖表結果 (hazard 代碼)，CRW4 對同一配對的結果永遠相同，任何批次算過的配對都可以直接組成新的圖表：
+    - pair_index.json 紀錄 CAS → 連續 index
+    - pairs.u8 為以 memmap 開啟的 uint8 上三角陣列，配對 (i < j) 位於 coverage.pair_position(i, j)，0 表示尚未計算
+    新增化學品只需在檔尾擴充，不需重排；一萬筆化學品約 5 千萬個配對、50 MB，查詢時不需整個載入記憶體
+    """
+    INDEX_FILE = "pair_index.json"
+    DATA_FILE = "pairs.u8"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, self.INDEX_FILE)
+        self.data_path = os.path.join(directory, self.DATA_FILE)
+        self.cas_list = []
+        self.ingested = {}  # 已匯入的 xlsx 檔名 → "大小:修改時間"，重新匯入時略過未變更的檔案
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.cas_list = data.get("cas", [])
+            self.ingested = data.get("ingested", {})
+        self.index = {cas: i for i, cas in enumerate(self.cas_list)}
+        self._data = None
+        self.listeners = []  # 寫入後呼叫 listener(positions, values)，例如 HazardIndex.update
+        # 排程器 worker 寫入、API 請求執行緒直接查詢，兩者以同一個 lock 保護 (listener 在持有 lock 時呼叫)
+        self.lock = threading.RLock()
+
+    # ---- 檔案處理 ----
+    def _pair_count(self, count=None):
+        count = len(self.cas_list) if count is None else count
+        return count * (count - 1) // 2
+
+    def _open_data(self):
+        """依目前化學品數量開啟 (必要時擴充) 資料檔"""
+        needed = self._pair_count()
+        if self._data is not None and len(self._data) >= needed:
+            return self._data
+        current = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        self._data = None  # Windows 需先釋放 memmap 才能改變檔案大小
+        if current < needed:
+            os.makedirs(self.directory, exist_ok=True)
+            # 每次至少擴充一倍，避免每個批次都重開檔案
+            size = max(needed, current * 2, 4096)
+            with open(self.data_path, 'ab') as f:
+                f.truncate(size)
+            current = size
+        self._data = np.memmap(self.data_path, dtype=np.uint8, mode='r+', shape=(current,))
+        return self._data
+
+    def flush(self):
+        with self.lock:
+            if self._data is not None:
+                self._data.flush()
+            self._save_index()
+
+    def _save_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"cas": self.cas_list, "ingested": self.ingested}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    # ---- 索引 ----
+    def add_chemicals(self, cas_list):
+        """
+        替尚未收錄的 CAS 配發 index，回傳每筆 CAS 的 index 陣列。
+        有新的 CAS 時先寫入 pair_index.json 才寫入資料：否則寫入代碼後當掉，重新啟動時
+        同一個 index 會配發給別的 CAS，資料檔中的代碼就變成錯誤的配對結果
+        """
+        with self.lock:
+            added = False
+            for cas in cas_list:
+                if cas not in self.index:
+                    self.index[cas] = len(self.cas_list)
+                    self.cas_list.append(cas)
+                    added = True
+            if added:
+                self._save_index()
+            return np.array([self.index[cas] for cas in cas_list], dtype=np.int64)
+
+    def _indices(self, cas_list):
+        """每筆 CAS 的 index，未收錄的為 -1"""
+        return np.array([self.index.get(cas, -1) for cas in cas_list], dtype=np.int64)
+
+    def _gather(self, a, b):
+        """讀取 index 陣列 a、b 對應配對的代碼 (任一方未收錄或相同時為 0)"""
+        codes = np.zeros(len(a), dtype=np.uint8)
+        valid = (a >= 0) & (b >= 0) & (a != b)
+        if not valid.any() or not os.path.exists(self.data_path):
+            return codes
+        low, high = np.minimum(a[valid], b[valid]), np.maximum(a[valid], b[valid])
+        codes[valid] = self._open_data()[pair_position(low, high)]
+        return codes
+
+    # ---- 查詢 ----
+    def get(self, a, b):
+        """單一配對的代碼，O(1)"""
+        with self.lock:
+            i, j = self.index.get(a), self.index.get(b)
+            if i is None or j is None or i == j:
+                return 0
+            if i > j:
+                i, j = j, i
+            return int(self._open_data()[pair_position(i, j)])
+
+    def row(self, cas, cas_list):
+        """cas 與 cas_list 中每個化學品的代碼 (uint8 陣列，自己為 0)"""
+        with self.lock:
+            others = self._indices(cas_list)
+            return self._gather(np.full(len(others), self.index.get(cas, -1), dtype=np.int64), others)
+
+    def row_all(self, cas):
+        """cas 與所有已收錄化學品的代碼 (依 index 排列；cas 未收錄時回傳 None)"""
+        with self.lock:
+            i = self.index.get(cas)
+            if i is None:
+                return None
+            others = np.arange(len(self.cas_list), dtype=np.int64)
+            return self._gather(np.full(len(others), i, dtype=np.int64), others)
+
+    def block(self, cas_list, other_list=None):
+        """
+        cas_list × other_list 的代碼矩陣 (未指定 other_list 時為 cas_list 的 (n, n) 對稱矩陣)，
+        未計算的配對與對角線為 0
+        """
+        with self.lock:
+            rows = self._indices(cas_list)
+            cols = rows if other_list is None else self._indices(other_list)
+            a, b = np.repeat(rows, len(cols)), np.tile(cols, len(rows))
+            return self._gather(a, b).reshape(len(rows), len(cols))
+
+    def uncovered_pairs(self, cas_list):
+        """尚未有結果的配對 [(cas_a, cas_b), ...] (介面與 PairCoverage 相同，可直接交給 planner.plan_uncovered)"""
+        with self.lock:
+            cas_list = list(dict.fromkeys(cas_list))
+            indices = self._indices(cas_list)
+            rows, cols = np.triu_indices(len(cas_list), k=1)
+            codes = self._gather(indices[rows], indices[cols])
+            missing = codes == 0
+            return [(cas_list[i], cas_list[j]) for i, j in zip(rows[missing], cols[missing])]
+
+    def codes(self):
+        """所有配對的代碼 (memmap 的唯讀視圖，位置即 pair_position)"""
+        with self.lock:
+            if not self.cas_list or not os.path.exists(self.data_path):
+                return np.zeros(0, dtype=np.uint8)
+            return self._open_data()[:self._pair_count()]
+
+    def stats(self):
+        """收錄化學品數與已計算配對數 (會掃描整個資料檔)"""
+        with self.lock:
+            known = int(np.count_nonzero(self._open_data()[:self._pair_count()])) if self.cas_list else 0
+            return {"chemicals": len(self.cas_list), "pairs": self._pair_count(), "known": known}
+
+    # ---- 寫入 ----
+    def record(self, cas_list, codes, save=True):
+        """紀錄一份圖表 (cas_list 與 (n, n) 代碼矩陣) 中所有已計算的配對，回傳紀錄筆數"""
+        with self.lock:
+            cas_list = list(cas_list)
+            codes = np.asarray(codes, dtype=np.uint8)
+            indices = self.add_chemicals(cas_list)
+            rows, cols = np.triu_indices(len(cas_list), k=1)
+            values = np.where(codes[rows, cols] != 0, codes[rows, cols], codes[cols, rows])
+            keep = (values != 0) & (indices[rows] != indices[cols])
+            if keep.any():
+                low = np.minimum(indices[rows][keep], indices[cols][keep])
+                high = np.maximum(indices[rows][keep], indices[cols][keep])
+                positions = pair_position(low, high)
+                self._open_data()[positions] = values[keep]
+                self._notify(positions, values[keep])
+            if save:
+                self.flush()
+            return int(keep.sum())
+
+    def _notify(self, positions, values):
+        for listener in self.listeners:
+            try:
+                listener(positions, values)
+            except Exception as e:
+                logger.warning(f"配對結果更新通知失敗: {e}")
+
+    @staticmethod
+    def _file_stamp(path):
+        stat = os.stat(path)
+        return f"{stat.st_size}:{int(stat.st_mtime)}"
+
+    def pending_exports(self, paths, force=False):
+        """尚未匯入或匯入後有變更的 xlsx (force=True 時全部)"""
+        with self.lock:
+            return [path for path in paths if force or self.ingested.get(os.path.basename(path)) != self._file_stamp(path)]
+
+    def record_export(self, path, cas_list, codes):
+        """紀錄一份已解析的 xlsx 並標記為已匯入，回傳紀錄筆數"""
+        with self.lock:
+            count = self.record(cas_list, codes, save=False)
+            self.ingested[os.path.basename(path)] = self._file_stamp(path)
+            self.flush()
+            logger.info(f"由 {path} 紀錄 {count} 筆配對結果 ({len(cas_list)} 筆化學品)")
+            return count
@@ -0,0 +1,105 @@
+import copy
+import json
+import os
+
+from logger import logger
+from planner import group_label
+
+
+class PartitionManifest:
+    """
+    基礎資料分組的持久化紀錄 (partition.json)
+    已分組的化學品永遠留在原本的組別，新增的化學品只補進尚有空位的組別或新開一組，
+    因此組別標籤 (A、B、…) 與 algo_done.txt 的進度不會因為基礎資料插入新化學品而位移
+    """
+    COMPACT_RATIO = 0.25  # 除役空位超過此比例才整理分組
+
+    def __init__(self, path, group_size=100):
+        self.path = path
+        self.group_size = group_size
+        self.groups = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.group_size = data.get("group_size", group_size)
+            self.groups = data.get("groups", {})
+        self.location = {cas: label for label, group in self.groups.items() for cas in group if cas is not None}
+
+    def cas_list(self):
+        """依組別順序回傳所有化學品 (不含已除役的空位)"""
+        return [cas for group in self.groups.values() for cas in group if cas is not None]
+
+    def update(self, cas_list):
+        """
+        將基礎資料中尚未分組的化學品補進分組，回傳有變動的組別標籤列表
+        """
+        changed = []
+        open_labels = [label for label, group in self.groups.items() if len(group) < self.group_size]
+        for cas in dict.fromkeys(cas_list):
+            if cas in self.location:
+                continue
+            while open_labels and len(self.groups[open_labels[0]]) >= self.group_size:
+                open_labels.pop(0)
+            if not open_labels:
+                label = group_label(len(self.groups))
+                self.groups[label] = []
+                open_labels.append(label)
+            label = open_labels[0]
+            self.groups[label].append(cas)
+            self.location[cas] = label
+            if label not in changed:
+                changed.append(label)
+        if changed:
+            logger.info(f"分組新增化學品，變動組別: {changed}")
+            self.save()
+        return changed
+
+    def retire(self, cas_list):
+        """
+        除役化學品：在原位置留下空位 (null)，其他化學品與組別標籤都不變動。
+        空位比例過高時才整理，回傳有變動的組別標籤列表
+        """
+        changed = []
+        for cas in dict.fromkeys(cas_list):
+            label = self.location.pop(cas, None)
+            if label is None:
+                continue
+            group = self.groups[label]
+            group[group.index(cas)] = None
+            if label not in changed:
+                changed.append(label)
+        if changed:
+            logger.info(f"分組除役化學品，變動組別: {changed}")
+            self.compact()
+            self.save()
+        return changed
+
+    def fragmentation(self):
+        """除役空位佔所有位置的比例"""
+        slots = sum(len(group) for group in self.groups.values())
+        holes = sum(1 for group in self.groups.values() for cas in group if cas is None)
+        return holes / slots if slots else 0.0
+
+    def compact(self, force=False):
+        """移除各組的除役空位，讓新化學品可以補進；化學品仍留在原組別"""
+        if not force and self.fragmentation() <= self.COMPACT_RATIO:
+            return False
+        for label, group in self.groups.items():
+            self.groups[label] = [cas for cas in group if cas is not None]
+        logger.info("分組空位過多，已整理分組")
+        return True
+
+    def preview(self):
+        """不會寫回檔案的複本 (dry-run 用)"""
+        preview = copy.deepcopy(self)
+        preview.path = None
+        return preview
+
+    def save(self):
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"group_size": self.group_size, "groups": self.groups}, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.path)
@@ -5,8 +5,10 @@ app = Flask("app")
 api = Api(app, version='2.0.0', title='奇美CRW4 Automation API模擬', doc='/api/doc')
 api_ns = Namespace("Systex", "all right reserve", path="/")
 api_test = Namespace("test", "Test API Here", path="/")
+api_hazard = Namespace("Hazard", "已計算配對的相容性/危害查詢", path="/hazard")
 api.add_namespace(api_ns)
 api.add_namespace(api_test)
+api.add_namespace(api_hazard)
 add_chemical_input_payload = api_ns.model(
     "Insert Input",
     {
@@ -52,10 +54,18 @@ queue_list_payload = api_ns.model(
             "7697-37-2", "10043-35-3", "13138-45-9", "10141-05-6", "3251-23-8",
             "7779-88-6", "10325-94-7", "10099-74-8", "7761-88-8", "10102-45-1"
         ]),
-        'id': fields.String(required=True, default="001")
+        'id': fields.String(required=True, default="001"),
+        'refresh': fields.Boolean(required=False, default=False, description="忽略回應快取重新執行")
     },
 )
 
+resolution_payload = api_ns.model(
+    "Resolution",
+    {
+        "cas": fields.String(required=True, default="7429-90-5"),
+        "chemical_name": fields.String(required=True, default="ALUMINUM POWDER, UNCOATED")
+    },
+)
 
 general_output_payload = api_ns.model(
     "general Output",
@@ -68,3 +78,20 @@ general_output_payload = api_ns.model(
     },
 )
 
+
+hazard_query_parser = reqparse.RequestParser()
+hazard_query_parser.add_argument("hazard", type=str, action="split", required=False, default=[],
+                                 help="相容性等級 (incompatible/caution/compatible) 或危害類別 (heat/gas/toxic/flammable/fire/explosive)，以逗號分隔")
+hazard_query_parser.add_argument("offset", type=int, required=False, default=0)
+hazard_query_parser.add_argument("limit", type=int, required=False, default=100, help="每頁筆數 (最多 1000)")
+
+hazard_output_payload = api_hazard.model(
+    "Hazard Output",
+    {
+        "status": fields.Integer(
+            required=True, description="0 for success, 1 for failure", default=1
+        ),
+        "result": fields.Raw(required=True),
+        "error": fields.String(required=False, default=""),
+    },
+)
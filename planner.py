@@ -0,0 +1,438 @@
+import math
+from itertools import combinations
+
+from logger import logger
+
+
+def split_list(data, chunk_size):
+    """將 data 切分成每個大小不超過 chunk_size 的子清單"""
+    return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+def split_even(data, parts):
+    """將 data 平均切成 parts 份，各份數量差距不超過 1 筆"""
+    size, extra = divmod(len(data), parts)
+    result = []
+    start = 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        result.append(data[start:end])
+        start = end
+    return result
+
+def group_label(index):
+    """依序產生組別標籤 A、B、…、Z、AA、AB…"""
+    label = ""
+    index += 1
+    while index > 0:
+        index, rem = divmod(index - 1, 26)
+        label = chr(ord('A') + rem) + label
+    return label
+
+def legacy_plan(cas_list, capacity=100):
+    """
+    原本 record_test.py / CRW4Algorithm 的排程方式：
+    先每 capacity 筆切成一組做組內計算，再把每組拆成上下半部(A, A')，
+    任兩組的半部兩兩配對。批次名稱與 algo_done.txt 相同 (A, A_B, A'_B' ...)
+    """
+    groups = split_list(cas_list, capacity)
+    labels = [group_label(i) for i in range(len(groups))]
+    sub_chunk_size = capacity // 2
+
+    batches = {}
+    for label, group in zip(labels, groups):
+        batches[label] = group
+
+    for (i, group_A), (j, group_B) in combinations(enumerate(groups), 2):
+        subs_A = split_list(group_A, sub_chunk_size)
+        subs_B = split_list(group_B, sub_chunk_size)
+        for a, sub_A in enumerate(subs_A):
+            for b, sub_B in enumerate(subs_B):
+                label_A = labels[i] + ("'" if a else "")
+                label_B = labels[j] + ("'" if b else "")
+                batches[f"{label_A}_{label_B}"] = sub_A + sub_B
+    return batches
+
+def cover_block_pairs(block_count, parts):
+    """
+    以貪婪法找出一組 parts 個區塊的組合，使任兩個區塊至少同時出現在一個組合中
+    (pair covering design)。回傳區塊 index 的 tuple 列表
+    """
+    if block_count <= parts:
+        return [tuple(range(block_count))]
+
+    uncovered = {i: set(range(block_count)) - {i} for i in range(block_count)}
+    remaining = block_count * (block_count - 1) // 2
+    designs = []
+    while remaining:
+        # 從尚未覆蓋配對最多的區塊開始，逐一加入能新增最多配對的區塊
+        first = max(uncovered, key=lambda i: (len(uncovered[i]), -i))
+        chosen = [first]
+        while len(chosen) < parts:
+            best, best_key = None, (0, 0)
+            for cand in range(block_count):
+                if cand in chosen:
+                    continue
+                gain = sum(1 for c in chosen if cand in uncovered[c])
+                key = (gain, len(uncovered[cand]))
+                if gain and key > best_key:
+                    best, best_key = cand, key
+            if best is None:
+                break
+            chosen.append(best)
+        for a, b in combinations(chosen, 2):
+            if b in uncovered[a]:
+                uncovered[a].discard(b)
+                uncovered[b].discard(a)
+                remaining -= 1
+        designs.append(tuple(sorted(chosen)))
+    return designs
+
+def greedy_plan(cas_list, capacity=100, parts=None):
+    """
+    以區塊覆蓋設計排程：把 CAS 清單切成大小為 capacity // parts 的區塊，
+    每個批次放入 parts 個區塊，並保證任兩個區塊至少同批一次。
+    parts 未指定時會在 2~10 之間試算，取批次數最少者 (parts=3 即三分之一區塊設計)
+    """
+    if len(cas_list) <= capacity:
+        return {"G1-001": list(cas_list)} if cas_list else {}
+
+    if parts is None:
+        best = None
+        for candidate in range(2, min(10, capacity) + 1):
+            plan = greedy_plan(cas_list, capacity, parts=candidate)
+            if best is None or len(plan) < len(best):
+                best = plan
+        return best
+
+    block_size = capacity // parts
+    block_count = math.ceil(len(cas_list) / block_size)
+    blocks = split_even(cas_list, block_count)
+
+    batches = {}
+    for idx, design in enumerate(cover_block_pairs(block_count, parts), start=1):
+        batch = []
+        for block in design:
+            batch.extend(blocks[block])
+        batches[f"G{parts}-{idx:03d}"] = batch
+    return batches
+
+def prime_power(q):
+    """若 q 為質數次方回傳 (p, m)，否則回傳 None"""
+    if q < 2:
+        return None
+    for p in range(2, q + 1):
+        if q % p == 0:
+            m = 0
+            while q % p == 0:
+                q //= p
+                m += 1
+            return (p, m) if q == 1 else None
+
+def galois_field(q):
+    """
+    建立有限體 GF(q) 的加法與乘法表，元素以 0~q-1 表示
+    (以 p 進位的各位數作為多項式係數，乘法取模於一個不可約多項式)
+    """
+    p, m = prime_power(q)
+
+    def digits(x):
+        return [(x // p ** i) % p for i in range(m)]
+
+    def number(coeffs):
+        return sum(c * p ** i for i, c in enumerate(coeffs))
+
+    add = [[number([(a + b) % p for a, b in zip(digits(x), digits(y))]) for y in range(q)] for x in range(q)]
+
+    for modulus in range(q):
+        # 首項係數為 1 的 m 次多項式 x^m + (modulus 的各位數)
+        low = digits(modulus)
+        mul = []
+        for x in range(q):
+            row = []
+            for y in range(q):
+                prod = [0] * (2 * m - 1)
+                for i, a in enumerate(digits(x)):
+                    for j, b in enumerate(digits(y)):
+                        prod[i + j] = (prod[i + j] + a * b) % p
+                for k in range(len(prod) - 1, m - 1, -1):
+                    coef = prod[k]
+                    if coef:
+                        prod[k] = 0
+                        for i, c in enumerate(low):
+                            prod[k - m + i] = (prod[k - m + i] - coef * c) % p
+                row.append(number(prod[:m]))
+            mul.append(row)
+        # 沒有零因子才是體
+        if all(mul[x][y] for x in range(1, q) for y in range(1, q)):
+            return add, mul
+    raise ValueError(f"找不到 GF({q}) 的不可約多項式")
+
+def plane_lines(q, projective=False):
+    """
+    產生 q 階仿射平面 AG(2, q) 的所有直線 (q^2 點、q^2 + q 條線、每條 q 點)；
+    projective=True 則產生投影平面 PG(2, q) (q^2 + q + 1 點與線、每條 q + 1 點)。
+    任兩點恰好同在一條直線上
+    """
+    add, mul = galois_field(q)
+    lines = []
+    for slope in range(q):
+        for intercept in range(q):
+            line = [x * q + add[mul[slope][x]][intercept] for x in range(q)]
+            if projective:
+                line.append(q * q + slope)
+            lines.append(line)
+    for x in range(q):
+        line = [x * q + y for y in range(q)]
+        if projective:
+            line.append(q * q + q)
+        lines.append(line)
+    if projective:
+        lines.append([q * q + i for i in range(q + 1)])
+    return lines
+
+def design_plan(cas_list, capacity=100):
+    """
+    以有限平面 (affine / projective plane) 區塊設計排程：把 CAS 清單平均分配到平面上的點，
+    每條直線對應一個批次。在所有 capacity 放得下的質數次方 q 中取批次數最少者
+    """
+    if len(cas_list) <= capacity:
+        return {"G1-001": list(cas_list)} if cas_list else {}
+
+    best = None
+    for q in range(2, capacity + 1):
+        if prime_power(q) is None:
+            continue
+        for projective in (False, True):
+            points = q * q + (q + 1 if projective else 0)
+            per_point = math.ceil(len(cas_list) / points)
+            if per_point * (q + (1 if projective else 0)) > capacity:
+                continue
+            runs = q * q + q + (1 if projective else 0)
+            if best is None or runs < best[0]:
+                best = (runs, q, projective)
+    if best is None:
+        return None
+
+    _, q, projective = best
+    lines = plane_lines(q, projective)
+    points = split_even(cas_list, q * q + (q + 1 if projective else 0))
+    prefix = f"PG{q}" if projective else f"AG{q}"
+
+    batches = {}
+    seen = set()
+    for line in lines:
+        batch = []
+        for point in line:
+            batch.extend(points[point])
+        # 點數比化學品多時會有空點，略過重複或不足兩筆的批次
+        key = frozenset(batch)
+        if len(batch) < 2 or key in seen:
+            continue
+        seen.add(key)
+        batches[f"{prefix}-{len(batches) + 1:03d}"] = batch
+    return batches
+
+def best_plan(cas_list, capacity=100):
+    """同時試算區塊設計與貪婪覆蓋，取批次數較少者"""
+    candidates = [design_plan(cas_list, capacity), greedy_plan(cas_list, capacity)]
+    return min((plan for plan in candidates if plan is not None), key=len)
+
+PLANNERS = {
+    "legacy": legacy_plan,
+    "greedy": greedy_plan,
+    "design": design_plan,
+    "best": best_plan,
+}
+
+def register_planner(name, planner):
+    """註冊新的排程方式，planner(cas_list, capacity, **kwargs) 需回傳 {batch_name: [cas, ...]}"""
+    PLANNERS[name] = planner
+
+def plan_batches(cas_list, capacity=100, strategy="best", **kwargs):
+    """依指定排程方式產生 {batch_name: [cas, ...]}，保證涵蓋所有不重複的化學品配對"""
+    if strategy not in PLANNERS:
+        raise ValueError(f"未知的排程方式: {strategy}")
+    return PLANNERS[strategy](list(cas_list), capacity, **kwargs)
+
+def lower_bound(count, capacity=100):
+    """Schönheim 下界：涵蓋 count 筆化學品所有配對至少需要的批次數"""
+    if count <= capacity:
+        return 1 if count else 0
+    return math.ceil(count / capacity * math.ceil((count - 1) / (capacity - 1)))
+
+def uncovered_pairs(batches, cas_list):
+    """回傳在 batches 中沒有被同批計算到的配對 (驗證用)"""
+    index = {cas: i for i, cas in enumerate(cas_list)}
+    covered = set()
+    for batch in batches.values():
+        ids = sorted(index[cas] for cas in batch if cas in index)
+        covered.update(combinations(ids, 2))
+    return [
+        (cas_list[i], cas_list[j])
+        for i, j in combinations(range(len(cas_list)), 2)
+        if (i, j) not in covered
+    ]
+
+def savings_report(cas_list, runs, capacity=100, strategy="best", coverage=None):
+    """
+    runs 個批次與原本的半部配對方式比較可節省的 CRW4 執行次數；
+    coverage 指定時原方式也只計算仍含未計算配對的批次 (接續原本的 algo_done 進度)
+    """
+    cas_list = list(dict.fromkeys(cas_list))
+    legacy = legacy_plan(cas_list, capacity)
+    if coverage is not None:
+        legacy = _still_needed(legacy, _adjacency(coverage.uncovered_pairs(cas_list)))
+    report = {
+        "strategy": strategy,
+        "chemicals": len(cas_list),
+        "capacity": capacity,
+        "runs": runs,
+        "legacy_runs": len(legacy),
+        "saved": len(legacy) - runs,
+        "lower_bound": lower_bound(len(cas_list), capacity),
+    }
+    logger.info(f"排程 {strategy}: {runs} 批次，原方式 {report['legacy_runs']} 批次，節省 {report['saved']} 次 (下界 {report['lower_bound']})")
+    return report
+
+def plan_report(cas_list, capacity=100, strategy="best", **kwargs):
+    """產生排程並與原本的半部配對方式比較可節省的 CRW4 執行次數"""
+    batches = plan_batches(cas_list, capacity, strategy, **kwargs)
+    return batches, savings_report(cas_list, len(batches), capacity, strategy)
+
+def order_batches(batches):
+    """
+    重新排列批次順序，讓相鄰批次共用的化學品越多越好 (貪婪最近鄰)，
+    增量執行時每次只需移除/新增兩批次間不同的化學品
+    """
+    remaining = {name: set(batch) for name, batch in batches.items()}
+    if not remaining:
+        return {}
+
+    current = next(iter(remaining))
+    ordered = {}
+    while True:
+        ordered[current] = batches[current]
+        current_set = remaining.pop(current)
+        if not remaining:
+            return ordered
+        current = max(remaining, key=lambda name: len(current_set & remaining[name]))
+
+def delta_operations(batches):
+    """依批次順序計算增量執行與每批重建所需的 add_chemical / remove 次數"""
+    rebuild_adds = sum(len(set(batch)) for batch in batches.values())
+    adds = removes = 0
+    previous = set()
+    for batch in batches.values():
+        current = set(batch)
+        adds += len(current - previous)
+        removes += len(previous - current)
+        previous = current
+    return {
+        "batches": len(batches),
+        "rebuild_adds": rebuild_adds,
+        "delta_adds": adds,
+        "delta_removes": removes,
+        "saved_adds": rebuild_adds - adds,
+    }
+
+def daily_plan(daily, base, capacity=100):
+    """
+    每日新增資料的排程：涵蓋 daily×daily 與 daily×base 的所有配對 (base×base 視為已計算)。
+    daily 較少時整批放入，base 以 capacity - len(daily) 為單位切塊補滿每次的空位；
+    daily 較多時把 daily 也切成 s 筆一份，每份與 capacity - s 筆的 base 切塊配對，
+    再另外排程 daily 各份之間的配對，s 取總批次數最少者
+    """
+    daily = list(dict.fromkeys(daily))
+    daily_set = set(daily)
+    base = [cas for cas in dict.fromkeys(base) if cas not in daily_set]
+    if not daily:
+        return {}
+    if not base:
+        return {f"XX-{name}": batch for name, batch in best_plan(daily, capacity).items()}
+
+    # daily 切成多份時 (parts > 1) 都需要另外排程 daily 各份之間的配對
+    cross_plan = best_plan(daily, capacity) if len(daily) > 1 else {}
+    cross_runs = len(cross_plan)
+    best = None
+    for size in range(1, min(len(daily), capacity - 1) + 1):
+        parts = math.ceil(len(daily) / size)
+        chunks = math.ceil(len(base) / (capacity - size))
+        runs = parts * chunks + (cross_runs if parts > 1 else 0)
+        if best is None or runs < best[0]:
+            best = (runs, parts, chunks)
+
+    _, parts, chunks = best
+    daily_parts = split_even(daily, parts)
+    base_chunks = split_even(base, chunks)
+
+    batches = {}
+    for i, daily_part in enumerate(daily_parts, start=1):
+        for j, base_chunk in enumerate(base_chunks, start=1):
+            batches[f"X{i}-{j:03d}"] = daily_part + base_chunk
+    if parts > 1:
+        for name, batch in cross_plan.items():
+            batches[f"XX-{name}"] = batch
+    return batches
+
+def _adjacency(pairs):
+    """配對列表 → {cas: 配對對象集合}"""
+    adjacency = {}
+    for a, b in pairs:
+        adjacency.setdefault(a, set()).add(b)
+        adjacency.setdefault(b, set()).add(a)
+    return adjacency
+
+def _still_needed(batches, adjacency):
+    """只保留仍含有未計算配對 (adjacency: cas -> 未計算的配對對象) 的批次"""
+    kept = {}
+    for name, batch in batches.items():
+        members = set(batch)
+        if any(adjacency[cas] & members for cas in members if cas in adjacency):
+            kept[name] = batch
+    return kept
+
+def plan_uncovered(cas_list, coverage, capacity=100, strategy="best", focus=None):
+    """
+    參考配對索引 coverage (見 coverage.PairCoverage)，只針對尚未計算的配對排程。
+    focus 指定時只處理至少一方在 focus 內的配對 (例如每日新增資料)。
+    試算兩種作法取批次數較少者：
+    - 重新產生相同的完整排程 (plan_batches / daily_plan 皆為確定性)，只保留仍含未計算配對的批次，
+      部分完成的回補可以接續原本的排程，不會比重新開始更多
+    - 在未計算配對構成的圖上以貪婪法取頂點覆蓋作為「新」化學品，
+      其餘有未計算配對的化學品作為配對對象，交給 daily_plan 排程 (未計算配對集中在少數化學品時較少)
+    """
+    cas_list = list(dict.fromkeys(cas_list))
+    missing = coverage.uncovered_pairs(cas_list)
+    if focus is not None:
+        focus = set(focus)
+        missing = [(a, b) for a, b in missing if a in focus or b in focus]
+    if not missing:
+        return {}
+    if focus is None and len(missing) == len(cas_list) * (len(cas_list) - 1) // 2:
+        return plan_batches(cas_list, capacity, strategy)
+
+    adjacency = _adjacency(missing)
+    involved = set(adjacency)
+
+    if focus is None:
+        full = plan_batches(cas_list, capacity, strategy)
+    else:
+        full = daily_plan([cas for cas in cas_list if cas in focus], [cas for cas in cas_list if cas not in focus], capacity)
+    resumed = _still_needed(full, adjacency)
+
+    remaining = {cas: set(others) for cas, others in adjacency.items()}
+    fresh = []
+    while remaining:
+        cas = max(remaining, key=lambda c: len(remaining[c]))
+        fresh.append(cas)
+        for other in remaining.pop(cas):
+            remaining[other].discard(cas)
+            if not remaining[other]:
+                del remaining[other]
+
+    fresh_set = set(fresh)
+    partners = [cas for cas in cas_list if cas in involved and cas not in fresh_set]
+    fresh = [cas for cas in cas_list if cas in fresh_set]
+    covering = daily_plan(fresh, partners, capacity)
+    logger.info(f"未計算配對 {len(missing)} 筆：接續完整排程 {len(resumed)} 批次，頂點覆蓋排程 {len(covering)} 批次")
+    return resumed if len(resumed) <= len(covering) else covering
@@ -1,8 +1,11 @@
 import os
+import sys
 import json
 from pathlib import Path
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))  # 由 record_test/ 直接執行時也能匯入專案模組
 # from app import mechanization
-from itertools import combinations
+from planner import plan_report
 
 def run_CRW4(batchName, batch): # 秉榮: 修改此處，加入 batchName 參數
     """
@@ -16,24 +19,8 @@ def split_list(data, chunk_size):
     """將 data 切分成每個大小不超過 chunk_size 的子清單"""
     return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
 
-def split_group_with_labels(group, label, sub_chunk_size):
-    """
-    將一組資料依 sub_chunk_size 切分，並標記上半部與下半部
-    若只有一個子組，則只會回傳 {label: subgroup}；若有兩個，則回傳
-    {label: first_half, label+"'": second_half}
-    """
-    subs = split_list(group, sub_chunk_size)
-    result = {}
-    if not subs:
-        return result
-    if len(subs) == 1:
-        result[label] = subs[0]
-    else:
-        result[label] = subs[0]
-        result[label + "'"] = subs[1]
-    return result
-
-DONE_FILE = Path("algo_done.txt")  # 一行一個 batch_name 的進度檔
+DONE_FILE = ROOT / "algo_done.txt"  # 一行一個 batch_name 的進度檔
+STRATEGY = "legacy"  # 排程方式：legacy / greedy / design / best，見 planner.py；非 legacy 的批次名稱與 algo_done.txt 不同，需搭配新的進度檔
 
 def read_done():
     """讀取已完成批次集合（若檔案不存在回傳空集合）"""
@@ -59,7 +46,7 @@ def should_skip(batch_name, done_set):
 
 def main():
     # 1. 讀取 JSON 檔案，抽取 success_item 並取出 CAS 號碼列表
-    json_path = r"/Users/howardhung/Vscode/CRW4-automation-new/record_test/SDS_911058_001_20251021.json"
+    json_path = ROOT / "record_test" / "SDS_911058_001_20251021.json"
     with open(json_path, 'r', encoding='utf-8') as f:
         data = json.load(f)
     
@@ -79,10 +66,10 @@ def main():
     group_labels = [chr(ord('A') + i) for i in range(len(groups))]
     
     # A.json, B.json, ...
-    output_base = r"/Users/howardhung/Vscode/CRW4-automation-new/record_test/"
+    output_dir = ROOT / "record_test"
     for label, group in zip(group_labels, groups):
         print(f"組 {label} 有 {len(group)} 筆資料")
-        file_name = f"{output_base}{label}.json"
+        file_name = output_dir / f"{label}.json"
         with open(file_name, 'w', encoding='utf-8') as f:
             json.dump(group, f, ensure_ascii=False, indent=4)
     
@@ -90,46 +77,21 @@ def main():
     done = read_done()
     print(f"\n前次完成批次數：{len(done)}")
 
-    print("\n=== 組內反應計算 ===")
-    # 每組內部配對：直接將每組的資料送入 CRW4
-    for label, group in zip(group_labels, groups):
-        if should_skip(label, done):
-            print(f"[SKIP] 組內 {label}（已完成）")
+    # 3. 依排程方式產生批次 (legacy 為原本的組內 + 上下半部配對，批次名稱與 algo_done.txt 相同)
+    batches, report = plan_report(cas_list, max_batch_size, strategy=STRATEGY)
+    print(f"排程方式 {STRATEGY}：共 {report['runs']} 批次，原方式 {report['legacy_runs']} 批次，節省 {report['saved']} 次 (下界 {report['lower_bound']})")
+
+    print("\n=== 批次反應計算 ===")
+    for batch_name, batch in batches.items():
+        if should_skip(batch_name, done):
+            print(f"[SKIP] 批次 {batch_name}（已完成）")
             continue
-        print(f"處理組 {label} 內部配對")
+        print(f"處理批次 {batch_name} (共 {len(batch)} 筆)")
         try:
-            # run_CRW4(label, group) # 秉榮: 修改此處，加入 batchName 參數
-            mark_done(label)  # 成功才進行記錄
+            # run_CRW4(batch_name, batch) # 秉榮: 修改此處，加入 batchName 參數
+            mark_done(batch_name)  # 成功才記錄
         except Exception as e:
-            print(f"[ERR] 組內 {label} 發生錯誤：{e}")
-            return 
-
-    print("\n=== 組間反應計算 ===")
-    # 3. 組間反應計算：任兩組之間所有配對
-    # 每次 CRW4 最多 100 筆，因此將每組拆分成上半部與下半部 (50 筆一組)
-    sub_chunk_size = max_batch_size // 2  # 50 筆
-    for (i, group_A), (j, group_B) in combinations(enumerate(groups), 2):
-        label_A = group_labels[i]
-        label_B = group_labels[j]
-        
-        # 將 group_A 與 group_B 分別拆分並標記為上半部與下半部
-        subs_A = split_group_with_labels(group_A, label_A, sub_chunk_size)
-        subs_B = split_group_with_labels(group_B, label_B, sub_chunk_size)
-        
-        # 子組間兩兩配對，並依照子組標籤印出
-        for sub_label_A, sub_group_A in subs_A.items():
-            for sub_label_B, sub_group_B in subs_B.items():
-                batch = sub_group_A + sub_group_B
-                combine_sub_label_name = f"{sub_label_A}_{sub_label_B}"
-                if(should_skip(combine_sub_label_name, done)):
-                    print(f"[SKIP] 組間 {combine_sub_label_name}（已完成）")
-                    continue
-                print(f"處理組 {sub_label_A} 與組 {sub_label_B} 的子組配對 (共 {len(batch)} 筆)")
-                try: 
-                    # run_CRW4(f"{combine_sub_label_name}", batch) # 秉榮: 修改此處，加入 batchName 參數
-                    mark_done(f"{combine_sub_label_name}")  # 成功才記錄（新增）
-                except Exception as e:
-                    print(f"[ERR ] 組間 {combine_sub_label_name} 發生錯誤：{e}")
+            print(f"[ERR ] 批次 {batch_name} 發生錯誤：{e}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,128 @@
+import json
+import os
+import re
+import threading
+
+from logger import logger
+
+# 判定為混合物/溶液/特殊型態的關鍵字，"non_mixture" 規則會避開這些候選
+MIXTURE_PATTERN = re.compile(r"MIXTURE|SOLUTION|ALLOY|WETTED|\bWET\b|FERTILIZER|EMULSION|SUSPENSION|%")
+# 純物質常見的型態描述，"solid" 規則優先選擇
+SOLID_PATTERN = re.compile(r", SOLID$|\[DRY\]|, DRY$|ANHYDROUS")
+
+
+def _candidates(names):
+    """[(Portal Row View 編號, 名稱), ...]，略過空白列"""
+    return [(i, name.strip()) for i, name in enumerate(names, start=1) if name and name.strip()]
+
+def prefix_rule(names):
+    """某一筆名稱是其他所有候選的開頭 (例如 POTASSIUM CHLORATE / POTASSIUM CHLORATE, AQUEOUS SOLUTION)"""
+    candidates = _candidates(names)
+    for i, name in candidates:
+        if all(other.startswith(name) for _, other in candidates):
+            return i
+    return None
+
+def non_mixture_rule(names):
+    """只有一筆不是混合物/溶液時選擇該筆"""
+    pure = [i for i, name in _candidates(names) if not MIXTURE_PATTERN.search(name)]
+    return pure[0] if len(pure) == 1 else None
+
+def solid_rule(names):
+    """只有一筆標示為固體/乾燥/無水時選擇該筆"""
+    solid = [i for i, name in _candidates(names) if SOLID_PATTERN.search(name)]
+    return solid[0] if len(solid) == 1 else None
+
+RULES = {
+    "prefix": prefix_rule,
+    "non_mixture": non_mixture_rule,
+    "solid": solid_rule,
+}
+DEFAULT_RULES = ("prefix", "non_mixture", "solid")
+
+def register_rule(name, func):
+    """註冊自訂規則：func(候選名稱列表) 回傳 Portal Row View 編號 (從 1 開始) 或 None"""
+    RULES[name] = func
+
+
+class ResolutionStore:
+    """
+    複數筆搜尋結果 (status 2) 的選擇紀錄 (resolutions.json)：
+    {"choices": {cas: {"index": Portal Row View 編號, "chemical_name": 名稱, "source": "operator" 或 "rule:<規則>"}}}
+    操作人員指定的選擇優先；沒有指定時依 rules 順序套用規則。resolve 只查詢不寫入，
+    實際選取時以 decide 將規則選出的結果寫入以便檢視與覆寫
+    """
+    def __init__(self, path, rules=DEFAULT_RULES):
+        self.path = path
+        self.rules = list(rules)
+        self.choices = {}
+        self.lock = threading.RLock()  # 排程器 worker 與 API 執行緒都會寫入
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.choices = json.load(f).get("choices", {})
+
+    def __contains__(self, cas):
+        return cas in self.choices
+
+    def get(self, cas):
+        return self.choices.get(cas)
+
+    def choose(self, cas, chemical_name, index=None, source="operator"):
+        """指定 cas 要選取的候選 (以名稱為準，index 僅供參考)"""
+        with self.lock:
+            self.choices[cas] = {"index": index, "chemical_name": chemical_name, "source": source}
+            self.save()
+            logger.info(f"cas:{cas} 複數結果選擇 {chemical_name} ({source})")
+
+    def forget(self, cas):
+        with self.lock:
+            if self.choices.pop(cas, None) is not None:
+                self.save()
+
+    def _resolve(self, cas, names):
+        """回傳 (編號, 名稱, 規則) 或 None；已有選擇時規則為 None"""
+        with self.lock:
+            choice = self.choices.get(cas)
+            if choice is not None:
+                for i, name in _candidates(names):
+                    if name == choice["chemical_name"]:
+                        return i, name, None
+                logger.warning(f"cas:{cas} 已選擇的 {choice['chemical_name']} 不在目前的搜尋結果中")
+                return None
+            for rule in self.rules:
+                index = RULES[rule](names)
+                if index is not None:
+                    return index, names[index - 1].strip(), rule
+            return None
+
+    def resolve(self, cas, names):
+        """
+        依候選名稱列表 (Portal Row View 1..n 的順序) 決定要選取的列，回傳 (編號, 名稱) 或 None，不會寫入選擇紀錄
+        已有選擇時以名稱對應目前的列；名稱已不在候選中則視為未解決
+        """
+        choice = self._resolve(cas, names)
+        return choice[:2] if choice is not None else None
+
+    def decide(self, cas, names):
+        """同 resolve，實際在 CRW4 選取時使用：由規則選出的結果會寫入選擇紀錄以便檢視與覆寫"""
+        choice = self._resolve(cas, names)
+        if choice is None:
+            return None
+        index, name, rule = choice
+        if rule is not None:
+            self.choose(cas, name, index, source=f"rule:{rule}")
+        return index, name
+
+    def pending(self, multiple):
+        """multiple ({cas: 候選名稱列表}) 中仍無法決定的 CAS"""
+        with self.lock:
+            return {cas: [name for _, name in _candidates(names)]
+                    for cas, names in multiple.items() if self.resolve(cas, names) is None}
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"choices": self.choices}, f, ensure_ascii=False, indent=4)
+            os.replace(tmp_path, self.path)
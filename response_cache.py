@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from logger import logger
+
+
+class ResponseCache:
+    """
+    /auto 與 /check 的回應快取，存放在 directory 下：
+    - index.json：{"version": "...", "entries": {key: {"kind", "cas", "size", "created", "last_used", "blob", "added"}}}
+    - {key}.json：格式化後的結果；/auto 的 CRW_Data_Export.xlsx 不另存複本，只紀錄 export_archive 中的內容雜湊 (blob)
+    key 為 kind + CRW4 版本 + 排序去重後 CAS 集合的雜湊，順序不同或重複送出的 cas_list 會對應到同一筆。
+    總大小超過 max_bytes 時淘汰最久未使用的項目；CRW4 版本改變時整份快取作廢
+    """
+    def __init__(self, directory, version, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.version = version
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, "index.json")
+        self.entries = {}
+        self.lock = threading.RLock()  # 排程器 worker 與 API 執行緒 (作廢) 都會寫入
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") == version:
+                self.entries = data.get("entries", {})
+            else:
+                logger.warning(f"CRW4 版本已變更 ({data.get('version')} -> {version})，回應快取作廢")
+                for key in data.get("entries", {}):
+                    self._remove_files(key)
+
+    def key(self, kind, cas_list):
+        canonical = "\n".join(sorted(set(cas_list)))
+        return hashlib.sha256(f"{kind}\n{self.version}\n{canonical}".encode("utf-8")).hexdigest()[:32]
+
+    def _path(self, key, ext):
+        return os.path.join(self.directory, f"{key}.{ext}")
+
+    def _remove_files(self, key):
+        for ext in ("json", "xlsx"):
+            path = self._path(key, ext)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def get(self, kind, cas_list):
+        """回傳 {"formatted": 格式化結果, "blob": 匯出檔的封存雜湊或 None, "added": 實際加入化合物的 CAS 或 None}，沒有快取時回傳 None"""
+        with self.lock:
+            key = self.key(kind, cas_list)
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            json_path = self._path(key, "json")
+            if not os.path.exists(json_path) or entry.get("xlsx"):
+                # 舊版在快取目錄另存 xlsx 複本，改為由封存取得後不再使用
+                logger.warning(f"回應快取 {key} 的檔案遺失或為舊版格式，視為未快取")
+                self.entries.pop(key)
+                self._remove_files(key)
+                self.save()
+                return None
+            with open(json_path, 'r', encoding='utf-8') as f:
+                formatted = json.load(f)
+            entry["last_used"] = time.time()
+            self.save()
+            logger.info(f"{kind} 命中回應快取 {key} ({len(set(cas_list))} 筆 CAS)")
+            return {"formatted": formatted, "blob": entry.get("blob"), "added": entry.get("added")}
+
+    def put(self, kind, cas_list, formatted, blob=None, added=None):
+        """儲存一次完整執行的結果；blob 為 /auto 匯出檔在 export_archive 中的內容雜湊，added 為實際加入化合物的 CAS"""
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            key = self.key(kind, cas_list)
+            with open(self._path(key, "json"), 'w', encoding='utf-8') as f:
+                json.dump(formatted, f, ensure_ascii=False)
+            size = os.path.getsize(self._path(key, "json"))
+            now = time.time()
+            self.entries[key] = {"kind": kind, "cas": sorted(set(cas_list)), "size": size, "created": now, "last_used": now, "blob": blob, "added": added}
+            self.evict()
+            self.save()
+
+    def invalidate(self, kind, cas_list):
+        with self.lock:
+            key = self.key(kind, cas_list)
+            if self.entries.pop(key, None) is not None:
+                self._remove_files(key)
+                self.save()
+
+    def invalidate_cas(self, cas_list=None):
+        """
+        作廢包含任一指定 CAS 的項目 (未指定則全部作廢)，回傳作廢筆數；
+        搜尋快取或複數結果選擇改變時使用，舊版沒有紀錄 CAS 的項目一併作廢
+        """
+        with self.lock:
+            cas_set = set(cas_list) if cas_list is not None else None
+            keys = [
+                key for key, entry in self.entries.items()
+                if cas_set is None or "cas" not in entry or cas_set.intersection(entry["cas"])
+            ]
+            for key in keys:
+                self.entries.pop(key)
+                self._remove_files(key)
+            if keys:
+                self.save()
+                logger.info(f"回應快取作廢 {len(keys)} 筆")
+            return len(keys)
+
+    def total_bytes(self):
+        return sum(entry["size"] for entry in self.entries.values())
+
+    def evict(self):
+        """依最後使用時間淘汰，直到總大小不超過 max_bytes"""
+        total = self.total_bytes()
+        for key in sorted(self.entries, key=lambda k: self.entries[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            total -= self.entries.pop(key)["size"]
+            self._remove_files(key)
+            logger.debug(f"回應快取淘汰 {key}")
+
+    def stats(self):
+        with self.lock:
+            return {"version": self.version, "entries": len(self.entries), "bytes": self.total_bytes(), "max_bytes": self.max_bytes}
+
+    def save(self):
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"version": self.version, "entries": self.entries}, f, ensure_ascii=False, indent=4)
+            os.replace(tmp_path, self.index_path)
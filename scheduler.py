@@ -0,0 +1,132 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+from logger import logger
+
+# 優先等級，數字越小越先執行
+INTERACTIVE = 0  # /check、/auto 等即時查詢
+DAILY = 1        # 每日新增資料配對
+BACKFILL = 2     # 基礎資料回補批次
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", DAILY: "daily", BACKFILL: "backfill"}
+
+
+class CRW4Scheduler:
+    """
+    CRW4 只有一個 GUI 實例，所有操作交由單一工作執行緒依優先等級依序執行。
+    長時間的回補以「每個批次一個工作」送入，因此高優先的查詢會在批次之間插隊，
+    插隊的工作完成後回補自動接續
+    """
+    def __init__(self):
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._inflight = {}  # key -> 尚未完成的工作，相同 key 的請求共用同一個 Future
+        self.running = None
+        self.stats_by_class = {
+            priority: {"completed": 0, "failed": 0, "coalesced": 0, "wait_total": 0.0, "wait_max": 0.0}
+            for priority in PRIORITY_NAMES
+        }
+
+    def submit(self, priority, func, *args, label=None, key=None, **kwargs):
+        """
+        送出一個工作，回傳 concurrent.futures.Future
+        key 指定時，若已有相同 key 的工作在佇列中或執行中，不會重複執行而是回傳該工作的 Future
+        (尚未開始時會提升到較高的優先等級)，結果由所有請求共用
+        """
+        with self._condition:
+            job = self._inflight.get(key) if key is not None else None
+            if job is not None:
+                self.stats_by_class[priority]["coalesced"] += 1
+                if priority < job["priority"] and not job["started"]:
+                    # 以較高的優先等級重新排入，舊的佇列項目在取出時略過
+                    job["priority"] = priority
+                    heapq.heappush(self._queue, (priority, next(self._counter), job))
+                    self._condition.notify()
+                logger.debug(f"工作 {label or job['label']} 與執行中的 {job['label']} 合併")
+                return job["future"]
+
+            job = {
+                "label": label or getattr(func, "__name__", "job"),
+                "func": func,
+                "args": args,
+                "kwargs": kwargs,
+                "future": Future(),
+                "submitted": time.monotonic(),
+                "priority": priority,
+                "started": False,
+                "key": key,
+            }
+            if key is not None:
+                self._inflight[key] = job
+            heapq.heappush(self._queue, (priority, next(self._counter), job))
+            self._condition.notify()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name="CRW4Scheduler", daemon=True)
+                self._thread.start()
+        logger.debug(f"排程工作 {job['label']} ({PRIORITY_NAMES.get(priority, priority)})")
+        return job["future"]
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                priority, _, job = heapq.heappop(self._queue)
+                if job["started"] or priority != job["priority"]:
+                    continue  # 已提升優先等級而重新排入的舊項目
+                job["started"] = True
+                self.running = (priority, job["label"])
+
+            stats = self.stats_by_class[priority]
+            if job["future"].set_running_or_notify_cancel():
+                wait = time.monotonic() - job["submitted"]
+                stats["wait_total"] += wait
+                stats["wait_max"] = max(stats["wait_max"], wait)
+                try:
+                    result = job["func"](*job["args"], **job["kwargs"])
+                    self._release(job)
+                    job["future"].set_result(result)
+                    stats["completed"] += 1
+                except Exception as e:
+                    logger.error(f"排程工作 {job['label']} 失敗: {e}")
+                    self._release(job)
+                    job["future"].set_exception(e)
+                    stats["failed"] += 1
+            else:
+                self._release(job)
+            self.running = None
+
+    def _release(self, job):
+        """工作結束後移出 in-flight 紀錄，之後相同 key 的請求會重新執行"""
+        with self._condition:
+            if job["key"] is not None and self._inflight.get(job["key"]) is job:
+                del self._inflight[job["key"]]
+
+    def stats(self):
+        """各優先等級的佇列深度與等待時間統計 (秒)"""
+        with self._condition:
+            depth = {priority: 0 for priority in PRIORITY_NAMES}
+            for priority, _, job in self._queue:
+                if not job["started"] and priority == job["priority"]:
+                    depth[priority] = depth.get(priority, 0) + 1
+            running = self.running
+
+        result = {}
+        for priority, name in PRIORITY_NAMES.items():
+            stats = self.stats_by_class[priority]
+            started = stats["completed"] + stats["failed"]
+            result[name] = {
+                "queued": depth[priority],
+                "completed": stats["completed"],
+                "failed": stats["failed"],
+                "coalesced": stats["coalesced"],
+                "wait_mean": round(stats["wait_total"] / started, 2) if started else 0.0,
+                "wait_max": round(stats["wait_max"], 2),
+            }
+        result["running"] = None if running is None else {"class": PRIORITY_NAMES.get(running[0]), "label": running[1]}
+        return result
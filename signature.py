@@ -0,0 +1,99 @@
+import json
+import os
+
+import numpy as np
+
+from logger import logger
+
+
+class SignatureCache:
+    """
+    CAS → CRW4 反應基團 (reactive groups) 的快取 (signatures.json)，以 CRW4 版本 (見 util.crw4_version) 區分：
+    {"version": "...", "signatures": {cas: [反應基團, ...]}, "unreadable": [cas, ...]}
+    CRW4 的相容性預測只取決於各化學品的反應基團，基團組合相同的化學品在圖表中的結果也相同。
+    讀取失敗或空的反應基團不會當成簽章 (無法判斷是否與其他化學品相同)，但會記在 unreadable，
+    同版本下不再重複搜尋；版本改變時整份快取作廢
+    """
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        self.signatures = {}
+        self.unreadable = set()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if "version" not in data:
+                # 舊版為 {cas: 反應基團} 且會把讀取失敗的 [] 寫入快取，載入時略過
+                self.signatures = {cas: groups for cas, groups in data.items() if groups}
+            elif data["version"] == version:
+                self.signatures = data.get("signatures", {})
+                self.unreadable = set(data.get("unreadable", []))
+            else:
+                logger.warning(f"CRW4 版本已變更 ({data['version']} -> {version})，反應基團快取作廢")
+
+    def __contains__(self, cas):
+        """是否已讀取過 (包含讀取失敗的)"""
+        return cas in self.signatures or cas in self.unreadable
+
+    def get(self, cas):
+        return self.signatures.get(cas)
+
+    def set(self, cas, groups):
+        """
+        紀錄 cas 的反應基團並寫回檔案，回傳是否有紀錄；
+        groups 為 None 或空的 (讀取失敗) 時只標記為 unreadable，同版本下不再重新讀取
+        """
+        if not groups:
+            self.unreadable.add(cas)
+            self.save()
+            return False
+        self.signatures[cas] = sorted(set(groups))
+        self.unreadable.discard(cas)
+        self.save()
+        return True
+
+    def missing(self, cas_list):
+        """尚未讀取過反應基團的 CAS"""
+        return [cas for cas in dict.fromkeys(cas_list) if cas not in self]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": self.version, "signatures": self.signatures, "unreadable": sorted(self.unreadable)}, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.path)
+
+def collapse(cas_list, cache):
+    """
+    依反應基團分類，每類只保留第一筆作為代表
+    回傳 (representatives, classes)；classes 為 {代表 CAS: [同類所有 CAS]}
+    沒有快取資料 (或反應基團為空) 的化學品各自成一類，不會被當成同類而略過
+    """
+    by_signature = {}
+    classes = {}
+    for cas in dict.fromkeys(cas_list):
+        groups = cache.get(cas)
+        key = tuple(groups) if groups else ("cas", cas)
+        representative = by_signature.setdefault(key, cas)
+        classes.setdefault(representative, []).append(cas)
+    representatives = list(classes)
+    logger.info(f"反應基團去重：{len(classes)} 類代表 {sum(len(m) for m in classes.values())} 筆化學品")
+    return representatives, classes
+
+def expand_codes(cas_list, codes, classes):
+    """
+    將代表組成的圖表 (cas_list 與 (n, n) 代碼矩陣) 展開到同類所有化學品，回傳 (成員清單, 成員之間的代碼矩陣)：
+    成員與其他化學品的配對沿用所屬代表的結果；同類成員之間的配對沿用代表自身 (對角線) 的結果，
+    代表沒有自身的結果時維持 0 (尚未計算)
+    """
+    members = []
+    owners = []
+    seen = set()
+    for k, cas in enumerate(cas_list):
+        for member in classes.get(cas, [cas]):
+            if member not in seen:
+                seen.add(member)
+                members.append(member)
+                owners.append(k)
+    owners = np.array(owners, dtype=np.int64)
+    return members, np.asarray(codes, dtype=np.uint8)[np.ix_(owners, owners)]
@@ -1,9 +1,28 @@
 import json
+import os
+import time
 
 from dotenv import load_dotenv
 from logger import logger
 from pywinauto import Application
-from util import CRW4Automation, file_handler
+from tqdm import tqdm
+from util import CRW4Automation, file_handler, crw4_version, xlsx_destination, export_archive, discard_crw4_export, crw4_export_path, check_for_file_ready
+from planner import daily_plan, plan_uncovered, plan_batches, order_batches, delta_operations, savings_report
+from coverage import PairCoverage
+from signature import SignatureCache, collapse, expand_codes
+from partition import PartitionManifest
+from costmodel import CostModel, record_timing
+from journal import ExecutionJournal, cas_set_hash
+from scheduler import CRW4Scheduler, BACKFILL
+from lookup_cache import LookupCache, NegativeCache
+from resolution import ResolutionStore
+from catalog import CatalogSnapshot
+from cas import preflight, normalize_cas
+from response_cache import ResponseCache
+from pairs import PairStore, verify_export, parse_exports, read_export
+from hazard_index import HazardIndex
+from hazard import cell_text
+from export import write_export
 
 # 讀取config.json
 with open("config.json", "r", encoding="utf-8") as f:
@@ -17,6 +36,14 @@ load_dotenv()
 base_json_path = r"D:\Systex\CRW4-automation\data\algrthom\test1.json"
 daily_json_path = r"D:\Systex\CRW4-automation\data\algrthom\daily.json"
 output_base = r"D:\Systex\CRW4-automation\data\algrthom\\"
+timings_path = os.path.join(OUTPUT_PATH, "timings.jsonl")  # 各批次執行耗時紀錄，供 CostModel 擬合
+journal_path = os.path.join(OUTPUT_PATH, "journal.jsonl")  # 批次內各步驟的執行紀錄，供中斷後接續
+lookup_cache_path = os.path.join(OUTPUT_PATH, "lookup_cache.json")  # CAS 搜尋結果快取
+negative_cache_path = os.path.join(OUTPUT_PATH, "negative_cache.json")  # CRW4 找不到的 CAS
+resolutions_path = os.path.join(OUTPUT_PATH, "resolutions.json")  # 複數筆搜尋結果的選擇紀錄
+response_cache_path = os.path.join(OUTPUT_PATH, "response_cache")  # /auto、/check 的回應快取
+pair_store_path = os.path.join(OUTPUT_PATH, "pair_store")  # 已計算配對的圖表結果 (memmap)
+coverage_path = os.path.join(OUTPUT_PATH, "coverage")  # 已計算配對索引 (排程使用)
 
 
 class CRW4Factory:
@@ -39,26 +66,159 @@ class CRW4Mechanization(CRW4Automation):
         self.crw4_automation = automation
         logger.info("CRW4Mechanization initialized")
         self.crw4_automationoutput_path = OUTPUT_PATH
+        self.journal = ExecutionJournal(journal_path)
+        self.lookup_cache = LookupCache(lookup_cache_path, crw4_version())
+        self.crw4_automation.lookup_cache = self.lookup_cache
+        self.negative_cache = NegativeCache(negative_cache_path, crw4_version())
+        self.crw4_automation.negative_cache = self.negative_cache
+        self.resolutions = ResolutionStore(resolutions_path)
+        self.crw4_automation.resolutions = self.resolutions
+        self.catalog = CatalogSnapshot(self.lookup_cache, self.negative_cache)  # 由搜尋快取組成的目錄檢視
+        self.response_cache = ResponseCache(response_cache_path, crw4_version())
+        self.pair_store = PairStore(pair_store_path)
+        self.coverage = PairCoverage(coverage_path)  # 已計算配對索引，與 pair_store 一律由 record_results 一起寫入
+        self.classes = {}  # 反應基團去重：代表 CAS -> 同類所有 CAS，寫入配對結果時展開到各成員
+        self.hazard_index = HazardIndex(self.pair_store, self.coverage)  # 依化學品/危害類別的反向索引，pair_store 寫入時自動更新，排除已除役的化學品
+
+    def catalog_seeds(self):
+        """收集目錄時要查詢的 CAS：基礎資料與每日資料中出現過的所有 CAS"""
+        seeds = []
+        for path in (base_json_path, daily_json_path):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for key in ("success_item", "fail_item", "muiltiple_item"):
+                seeds.extend(list(item.keys())[0] for item in data.get(key, []))
+        return preflight(seeds)["valid"]
+
+    def harvest_catalog(self, cas_list=None, chunk_size=200):
+        """
+        建立/增量更新化學品目錄：以 multiple_check 補查搜尋快取中尚未收錄的 CAS，結果由 multiple_check 寫入搜尋快取，
+        每 chunk_size 筆一段，中斷後重新執行只會查詢剩下的部分
+        """
+        pending = self.catalog.pending(preflight(cas_list)["valid"] if cas_list is not None else self.catalog_seeds())
+        logger.info(f"目錄已收錄 {len(self.catalog)} 筆，待查詢 {len(pending)} 筆")
+        if pending:
+            self.crw4_automation.checked_mixture = False
+            self.crw4_automation.add_mixture(mixture_name="catalog")
+            try:
+                for start in range(0, len(pending), chunk_size):
+                    results = self.crw4_automation.multiple_check(pending[start:start + chunk_size])
+                    if not results or results.get("status") != 0:
+                        logger.error(f"目錄收集中斷: {results}")
+                        break
+            finally:
+                self.crw4_automation.clear_mixture()
+        return self.catalog.stats()
+
+    def purge_negative_cache(self, cas_list=None):
+        """清除找不到資料快取，並作廢包含這些 CAS 的回應快取 (目錄直接由搜尋快取組成，會一併更新)"""
+        count = self.negative_cache.purge(cas_list)
+        self.response_cache.invalidate_cas(cas_list)
+        return count
+
+    def choose_resolution(self, cas, chemical_name):
+        """操作人員指定複數結果的選擇，並作廢包含該 CAS 的回應快取"""
+        self.resolutions.choose(cas, chemical_name)
+        self.response_cache.invalidate_cas([cas])
+
+    def resolution_summary(self):
+        """已選擇的複數結果與仍待操作人員選擇的 CAS"""
+        with self.resolutions.lock:
+            choices = dict(self.resolutions.choices)
+        return {"choices": choices, "pending": self.pending_resolutions()}
+
+    def pending_resolutions(self):
+        """搜尋快取中仍無法決定要選取哪一筆的複數結果 {cas: [候選名稱, ...]}"""
+        with self.lookup_cache.lock:
+            multiple = {cas: entry["chemical_name"] for cas, entry in self.lookup_cache.entries.items() if entry["status"] == 2}
+        return self.resolutions.pending(multiple)
 
     def test(self, cas):
         try:
-            result = self.crw4_automation.add_chemical(cas)
+            canonical = normalize_cas(cas)
+            if canonical is None:
+                return {"status": 1, "result": f"cas:{cas} 格式或檢查碼錯誤"}
+            result = self.crw4_automation.add_chemical(canonical)
             return result
         except Exception as e:
             return {"status": 1, "result": e.args[0], "error": e.__class__.__name__}
     
-    def automate_check(self, cas_list, id):
-        cas_list = list(set(cas_list))
+    def request_key(self, kind, cas_list):
+        """/auto、/check 請求的識別碼：與回應快取相同的 CAS 集合雜湊，用於合併同時送出的相同請求"""
+        checked = preflight(cas_list)
+        return f"{kind}:{self.response_cache.key(kind, self.cache_key(kind, checked))}"
+
+    def cache_key(self, kind, checked):
+        """回應快取使用的 CAS 集合；/check 的結果包含不合法的 CAS，因此一併納入"""
+        if kind == "check":
+            return checked["valid"] + [item["cas"] for item in checked["invalid"]]
+        return checked["valid"]
+
+    def cached_response(self, kind, cache_key, id):
+        """
+        回應快取命中時以新的 id 寫出 json (與 xlsx)，回傳與正常執行相同格式的結果 (/auto 包含 added 與 xlsx)；
+        未命中回傳 None
+        """
+        hit = self.response_cache.get(kind, cache_key)
+        if hit is None:
+            return None
+        xlsx_path = None
+        if hit["blob"]:
+            # xlsx 由封存還原 (同日同 id 已有相同內容的輸出檔時直接沿用)
+            xlsx_path = xlsx_destination(id, hit["blob"])
+            try:
+                if not os.path.exists(xlsx_path):
+                    export_archive().restore(hit["blob"], xlsx_path)
+            except OSError as e:
+                logger.warning(f"回應快取的匯出檔 {hit['blob'][:12]} 無法由封存還原，視為未快取: {e}")
+                self.response_cache.invalidate(kind, cache_key)
+                return None
+        formatted = dict(hit["formatted"], id=id)
+        result = file_handler("json", formatted, id)
+        return {
+            "id": id,
+            "status": result["result"],
+            "result": f"Json文件成功保存到 {OUTPUT_PATH}",
+            "cached": True,
+            "added": hit["added"],
+            "xlsx": xlsx_path,
+        }
+
+    def automate_check(self, cas_list, id, refresh=False):
+        """refresh=True 時忽略回應快取重新查詢"""
+        checked = preflight(cas_list)  # 正規化、檢查碼驗證並去除重複
+        cas_list = checked["valid"]
+        cache_key = self.cache_key("check", checked)
+        if not refresh:
+            cached = self.cached_response("check", cache_key, id)
+            if cached is not None:
+                return cached
         self.crw4_automationchecked_mixture = False
         try:
-            # 創建混合物
-            self.crw4_automation.add_mixture(mixture_name=id)
-
-            # 執行多筆檢查
-            results = self.crw4_automation.multiple_check(cas_list)
-
-            # 清空混合物
-            self.crw4_automation.clear_mixture()
+            # 目錄 (搜尋快取) 中已收錄的 CAS 直接回答
+            known, cas_list = self.catalog.answer(cas_list)
+            if cas_list:
+                # 創建混合物
+                self.crw4_automation.add_mixture(mixture_name=id)
+
+                # 執行多筆檢查
+                results = self.crw4_automation.multiple_check(cas_list)
+
+                # 清空混合物
+                self.crw4_automation.clear_mixture()
+            else:
+                # 全部命中目錄，不需操作 CRW4
+                logger.info(f"{len(known)} 筆 CAS 全部由目錄取得")
+                results = {"status": 0, "result": []}
+            if results and results.get("status") == 0:
+                # 不合法的 CAS 不送入 CRW4，以找不到資料回報
+                rejected = [
+                    {"cas": item["cas"], "status": 1, "result": {"status": 1, "result": {"cas": item["cas"], "chemical_name": ""}}, "error": item["reason"]}
+                    for item in checked["invalid"]
+                ]
+                results = {"status": 0, "result": known + results["result"] + rejected}
 
             # 寫入臨時 output.json 檔
             with open("output.json", 'w', encoding='utf-8') as f:
@@ -67,6 +227,8 @@ class CRW4Mechanization(CRW4Automation):
             # 格式化結果後，寫入檔案
             formatted_check_result = self.crw4_automation.formate_check_output(id, results)
             result = file_handler("json", formatted_check_result, id)
+            if results and results.get("status") == 0:
+                self.response_cache.put("check", cache_key, formatted_check_result)
 
         except Exception as e:
             return {"id": id, "status": 1, "result": e.args[0], "error": e.__class__.__name__}
@@ -77,27 +239,80 @@ class CRW4Mechanization(CRW4Automation):
             "result": f"Json文件成功保存到 {OUTPUT_PATH}"
         }
 
-    def automate(self, cas_list, id):
-        cas_list = list(set(cas_list)) # 去除重複 CAS
+    def automate(self, cas_list, id, resume=True, refresh=False):
+        """
+        建立化合物、新增化學品、輸出圖表並複製 xlsx。每完成一個步驟都寫入執行紀錄 (journal)，
+        resume=True 時若該批次上次中斷，會重新選取 CRW4 中原本的化合物並從最後確認完成的步驟接續
+        相同 CAS 集合執行過時直接由回應快取取得結果與 xlsx，refresh=True 時強制重新執行
+        """
+        checked = preflight(cas_list)  # 正規化、檢查碼驗證並去除重複 CAS
+        cas_list = checked["valid"]
+        if not refresh:
+            cached = self.cached_response("auto", self.cache_key("auto", checked), id)
+            # 舊版快取沒有紀錄 added，無法確認哪些配對已計算，視為未命中
+            if cached is not None and cached["added"] is not None:
+                return dict(cached, rejected=checked["invalid"])
         self.crw4_automation.checked_mixture = False  # 防呆機制
+        timing = {"batch": id, "size": len(cas_list)}
+        cas_hash = cas_set_hash(cas_list)
+        state = self.journal.state(id) if resume else None
+        if state and state["mixture"] and not state["done"] and state["cas_hash"] != cas_hash:
+            logger.warning(f"批次 {id} 的化學品與執行紀錄不同，不接續原本的化合物")
+            state = None
         try:
-            # 創建混合物
-            self.crw4_automation.add_mixture(mixture_name=id)
-
-            # 添加化學品
-            results = self.crw4_automation.multiple_search(cas_list)
+            if state and state["mixture"] and not state["done"] and self.crw4_automation.select_mixture(id)["status"] == 0:
+                logger.highlight(f"批次 {id} 由執行紀錄接續，已完成 {len(state['added'])}/{len(cas_list)} 筆化學品")
+            else:
+                # 創建混合物
+                start = time.perf_counter()
+                self.crw4_automation.add_mixture(mixture_name=id)
+                timing["add_mixture"] = time.perf_counter() - start
+                self.journal.record(id, "mixture", size=len(cas_list), cas_hash=cas_hash)
+                state = {"added": {}, "exported": False, "copied": False}
+
+            # 添加化學品 (略過紀錄中已完成的)
+            def journal_add(item):
+                # 發生例外 (error) 的不是確定的結果，不寫入紀錄，接續時會重試
+                if not item.get("error"):
+                    self.journal.record(id, "add", cas=item["cas"], item=item)
+
+            pending = [cas for cas in cas_list if cas not in state["added"]]
+            start = time.perf_counter()
+            results = self.crw4_automation.multiple_search(pending, on_result=journal_add)
+            timing["adds"], timing["add_chemical"] = len(pending), time.perf_counter() - start
+            if not results:
+                raise RuntimeError(f"批次 {id} 新增化學品失敗")
+            results["result"] = [state["added"][cas]["item"] for cas in cas_list if cas in state["added"]] + results["result"]
+            if pending:
+                state["exported"] = state["copied"] = False
 
             # 輸出圖表
-            self.crw4_automation.output_chart_to_csv()
-
-            # 產生 Excel
-            file_handler("xlsx", id=id)
+            start = time.perf_counter()
+            if not state["exported"]:
+                discard_crw4_export()
+                self.crw4_automation.output_chart_to_csv()
+                self.journal.record(id, "export")
+
+            # 產生 Excel (驗證內容確實是這個批次的化學品，不符時只重新輸出圖表)
+            added = [item["cas"] for item in results["result"] if item.get("status") == 0]
+            xlsx_path = state.get("xlsx") if state["copied"] else None
+            if not state["copied"]:
+                copied = self.copy_verified_export(id, added, cas_list)
+                if copied["status"] == 0:
+                    xlsx_path = copied["path"]
+                    # 先寫入配對結果再紀錄 copy，接續時不會略過尚未寫入的匯出檔
+                    self.ingest_export(xlsx_path)
+                    self.journal.record(id, "copy", path=xlsx_path)
+            timing["export"] = time.perf_counter() - start
 
             # 回到主頁面
             self.crw4_automation.click_button("Mixture\rManager")
 
             # 清空混合物
+            start = time.perf_counter()
             self.crw4_automation.clear_mixture()
+            timing["clear_mixture"] = time.perf_counter() - start
+            record_timing(timings_path, timing)
 
             # 整理輸出結果
             with open("output.json", 'w', encoding='utf-8') as f:
@@ -106,6 +321,9 @@ class CRW4Mechanization(CRW4Automation):
             # 格式化結果後，寫入檔案
             formatted_result = self.crw4_automation.format_output(id, results)
             result = file_handler("json", formatted_result, id)
+            self.journal.record(id, "done")
+            if xlsx_path:
+                self.response_cache.put("auto", self.cache_key("auto", checked), formatted_result, export_archive().latest(id)["blob"], added)
 
         except Exception as e:
             return {"id": id, "status": 1, "result": e.args[0], "error": e.__class__.__name__}
@@ -113,9 +331,261 @@ class CRW4Mechanization(CRW4Automation):
         return {
             "id": id,
             "status": result["result"],
-            "result": f"Json文件成功保存到 {OUTPUT_PATH}"
+            "result": f"Json文件成功保存到 {OUTPUT_PATH}",
+            "rejected": checked["invalid"],
+            "added": added,      # 實際加入化合物的 CAS
+            "xlsx": xlsx_path,   # 驗證通過的匯出檔，沒有時為 None
         }
 
+    def copy_verified_export(self, id, added, cas_list, retries=2):
+        """
+        等待 CRW4 寫出 CRW_Data_Export.xlsx，先以 verify_export 比對 added (成功加入化合物的 CAS) 再複製：
+        不符 (殘留上一批的檔案、缺少或多出化學品) 時只重新輸出圖表，不需重跑整個批次，
+        也不會覆蓋 OUTPUT_PATH/xlsx 中先前驗證通過的輸出檔。驗證通過才封存、複製並回傳 file_handler 的結果 (含封存的內容雜湊 blob)；
+        重試後仍不符或匯出檔始終沒有出現時拋出 RuntimeError，批次不會被標記為完成
+        """
+        source_path = crw4_export_path()
+        for attempt in range(retries + 1):
+            if attempt:
+                logger.warning(f"批次 {id} 重新輸出圖表 ({attempt}/{retries})")
+                discard_crw4_export()
+                self.crw4_automation.output_chart_to_csv()
+            if not check_for_file_ready(source_path, max_attempts=10, interval=3):
+                copied = {"status": 1, "result": "xlsx文件沒有被CRW4成功創建或寫入未完成，等待時間逾時"}
+                continue
+            report = verify_export(source_path, added)
+            if not report["ok"]:
+                logger.warning(f"批次 {id} 的匯出檔不符: {report['reason']} (缺少 {report['missing'][:5]}，多出 {report['extra'][:5]})")
+                copied = {"status": 1, "result": f"匯出檔驗證失敗: {report['reason']}", "verification": report}
+                continue
+            # 先封存 (內容定址，每份不同的結果只存一次)，OUTPUT_PATH/xlsx 的輸出檔名帶上內容雜湊
+            blob = export_archive().put(id, source_path, cas_list)["blob"]
+            copied = file_handler("xlsx", id=id, source_path=source_path, blob=blob)
+            if copied["status"] != 0:
+                raise RuntimeError(f"批次 {id} 的匯出檔複製失敗: {copied['result']}")
+            return dict(copied, blob=blob)
+        if "verification" in copied:
+            raise RuntimeError(f"批次 {id} 重新輸出 {retries} 次後匯出檔仍不符: {copied['verification']['reason']}")
+        raise RuntimeError(f"批次 {id} 重新輸出 {retries} 次後仍無法取得匯出檔: {copied['result']}")
+
+    def record_results(self, path, cas_list, codes):
+        """
+        紀錄一份匯出 xlsx 的配對結果：寫入 pair_store 並將這份圖表的配對標記到配對索引 (coverage)。
+        即時批次、/auto 與歷史 xlsx 匯入都經過這裡，排程器不會重算任何已有結果的配對。
+        圖表中的反應基團代表 (見 classes) 的結果會複製給同類的所有成員，成員的配對只有實際寫入結果的才標記為已計算。
+        回傳紀錄筆數
+        """
+        members, member_codes = expand_codes(cas_list, codes, self.classes)
+        count = self.pair_store.record_export(path, members, member_codes)
+        self.coverage.mark_batch(cas_list)
+        if len(members) > len(cas_list):
+            self.coverage.mark_batch(members, member_codes != 0)
+        return count
+
+    def ingest_export(self, xlsx_path):
+        """將匯出的圖表配對寫入 pair_store 與配對索引；解析失敗不影響批次結果"""
+        try:
+            cas_list, codes = read_export(xlsx_path)
+            self.record_results(xlsx_path, cas_list, codes)
+        except Exception as e:
+            logger.warning(f"解析 {xlsx_path} 的配對結果失敗: {e}")
+
+    def ingest_backlog(self, scheduler:CRW4Scheduler, processes=None, force=False):
+        """
+        重新解析 OUTPUT_PATH/xlsx 中所有歷史輸出並寫入 pair_store 與配對索引 (預設略過已匯入且未變更的檔案)。
+        解析在子行程中進行，不佔用排程器；每份解析完成的 xlsx 各自以一個 BACKFILL 工作寫入，
+        pair_store 仍只由排程器的工作者寫入，且互動請求可以在兩份之間插隊。請在排程器以外的執行緒呼叫
+        回傳 {"files", "skipped", "pairs", "failed": {檔名: 錯誤}}
+        """
+        xlsx_dir = os.path.join(OUTPUT_PATH, "xlsx")
+        if not os.path.isdir(xlsx_dir):
+            return {"files": 0, "skipped": 0, "pairs": 0, "failed": {}}
+        paths = sorted(os.path.join(xlsx_dir, name) for name in os.listdir(xlsx_dir) if name.endswith(".xlsx"))
+        pending = scheduler.submit(BACKFILL, self.pair_store.pending_exports, paths, force, label="ingest backlog: 檢查").result()
+        summary = {"files": len(pending), "skipped": len(paths) - len(pending), "pairs": 0, "failed": {}}
+        logger.info(f"開始匯入 {len(pending)} 份歷史 xlsx (略過 {summary['skipped']} 份未變更)")
+        for done, (path, cas_list, codes, error) in enumerate(parse_exports(pending, processes), start=1):
+            name = os.path.basename(path)
+            if error:
+                logger.warning(f"匯入 {path} 失敗: {error}")
+                summary["failed"][name] = error
+                continue
+            try:
+                summary["pairs"] += scheduler.submit(BACKFILL, self.record_results, path, cas_list, codes, label=f"ingest {name}").result()
+            except Exception as e:
+                summary["failed"][name] = f"{e.__class__.__name__}: {e}"
+            if done % 50 == 0:
+                logger.info(f"已匯入 {done}/{len(pending)} 份 xlsx")
+        logger.info(f"匯入完成: {summary['files']} 份 xlsx，{summary['pairs']} 筆配對，失敗 {len(summary['failed'])} 份")
+        return summary
+
+    def archived_export(self, id, blob=None):
+        """
+        由封存還原批次 id 的 xlsx (預設為最近一次執行，或指定 blob 雜湊)，
+        回傳 {"path", "run"}；沒有封存紀錄時回傳 None
+        """
+        archive = export_archive()
+        runs = archive.history(id)
+        run = next((entry for entry in reversed(runs) if entry["blob"] == blob), None) if blob else (runs[-1] if runs else None)
+        if run is None:
+            return None
+        restore_dir = os.path.join(OUTPUT_PATH, "restored")
+        os.makedirs(restore_dir, exist_ok=True)
+        path = archive.restore(run["blob"], os.path.join(restore_dir, f"{id}_{run['blob'][:12]}_CRW_Data_Export.xlsx"))
+        return {"path": path, "run": run}
+
+    def search_item(self, cas):
+        """由搜尋快取組成 multiple_search 格式的單筆結果 (已解決的複數結果視為成功)；從未搜尋過回傳 None"""
+        if cas in self.negative_cache:
+            return {"cas": cas, "status": 1, "result": {"cas": cas, "chemical_name": ""}}
+        entry = self.lookup_cache.get(cas)
+        if entry is None:
+            return None
+        if entry["status"] == 2:
+            choice = self.resolutions.resolve(cas, entry["chemical_name"])
+            if choice is None:
+                names = {f"{cas}_{i}": name for i, name in enumerate(entry["chemical_name"], start=1)}
+                return {"cas": cas, "status": 2, "result": {"result": names}}
+            return {"cas": cas, "status": 0, "result": {"cas": cas, "chemical_name": choice[1]}}
+        return {"cas": cas, "status": 0, "result": {"cas": cas, "chemical_name": entry["chemical_name"]}}
+
+    def chartable(self, cas_list):
+        """可以加入化合物的化學品：搜尋成功、複數結果已解決，或尚未搜尋過 (需要交由 CRW4 確認)"""
+        result = []
+        for cas in cas_list:
+            item = self.search_item(cas)
+            if item is None or item["status"] == 0:
+                result.append(cas)
+        return result
+
+    def automate_chart(self, cas_list, id, refresh=False):
+        """
+        由已計算的配對結果組成 cas_list 的完整 N×N 相容性圖表，只有尚未計算的配對才送入 CRW4：
+        以 planner.plan_uncovered 排出涵蓋缺少配對的最少批次，逐批 automate (結果會寫入 pair_store)，
+        全部配對都已知時不需操作 GUI。refresh=True 時整份清單以 plan_batches 重新排程交由 CRW4 執行
+        """
+        checked = preflight(cas_list)
+        cas_list = self.chartable(checked["valid"])
+        try:
+            if refresh:
+                batches = plan_batches(cas_list, capacity=100) if len(cas_list) > 1 else {}
+            else:
+                batches = plan_uncovered(cas_list, self.pair_store, capacity=100)
+            if batches:
+                logger.highlight(f"{id}: {len(self.pair_store.uncovered_pairs(cas_list))} 筆配對尚未計算，需執行 {len(batches)} 批次")
+            for batch_name, batch in batches.items():
+                result = self.automate(batch, f"{id}_{batch_name}", refresh=refresh)
+                if result.get("status") == 1:
+                    raise RuntimeError(f"批次 {id}_{batch_name} 執行失敗: {result.get('result')}")
+
+            # 批次中搜尋失敗的化學品不列入圖表
+            cas_list = self.chartable(cas_list)
+            codes = self.pair_store.block(cas_list)
+            missing = self.pair_store.uncovered_pairs(cas_list)
+            items = [self.search_item(cas) for cas in checked["valid"]]
+            formatted_result = self.crw4_automation.format_output(id, {"result": [item for item in items if item is not None]})
+            names = {cas: item["result"]["chemical_name"] for cas, item in zip(checked["valid"], items) if item and item["status"] == 0}
+            chart = {
+                "id": id,
+                "cas_list": cas_list,
+                "names": [names.get(cas, "") for cas in cas_list],
+                "chart": [[cell_text(code) if i != j else "" for j, code in enumerate(row)] for i, row in enumerate(codes)],
+                "missing": [list(pair) for pair in missing],
+            }
+            result = file_handler("json", formatted_result, id)
+            file_handler("json", chart, f"{id}_chart")
+            # 與 CRW4 匯出相同格式的 xlsx，不需再經過 GUI 的 Export Chart Data
+            xlsx_path = write_export(xlsx_destination(id), cas_list, chart["names"], lambda cas: self.pair_store.row(cas, cas_list))
+        except Exception as e:
+            return {"id": id, "status": 1, "result": e.args[0], "error": e.__class__.__name__}
+
+        return {
+            "id": id,
+            "status": result["result"],
+            "result": f"Json文件成功保存到 {OUTPUT_PATH}",
+            "xlsx": xlsx_path,
+            "batches": len(batches),
+            "missing": len(missing),
+            "rejected": checked["invalid"]
+        }
+
+    def automate_delta(self, batches, mixture_name="delta"):
+        """
+        增量執行多個批次 batches: {batch_name: [cas, ...]}
+        先排序讓相鄰批次共用最多化學品，整個過程只建立一次化合物，
+        每批只移除/新增與上一批不同的化學品後輸出圖表，最後才清空化合物
+        """
+        batches = order_batches(batches)
+        logger.info(f"增量執行操作數: {delta_operations(batches)}")
+        self.crw4_automation.checked_mixture = False  # 防呆機制
+        searched = {}   # cas -> multiple_search 的單筆結果
+        in_mixture = set()
+        outputs = {}
+        verified = {}   # batch_name -> 匯出檔驗證通過時化合物中的 CAS
+        try:
+            self.crw4_automation.add_mixture(mixture_name=mixture_name)
+
+            for batch_name, batch in batches.items():
+                batch_set = set(batch)
+                timing = {"batch": batch_name, "size": len(batch_set), "removes": len(in_mixture - batch_set)}
+                start = time.perf_counter()
+                for cas in in_mixture - batch_set:
+                    removed = self.crw4_automation.remove_chemical(cas)
+                    if removed["status"] == 4:
+                        raise RuntimeError(removed["result"])
+                    in_mixture.discard(cas)
+                timing["remove_chemical"] = time.perf_counter() - start
+
+                # 前幾批已確認找不到或複數筆的化學品不再重複搜尋
+                to_add = [
+                    cas for cas in dict.fromkeys(batch)
+                    if cas not in in_mixture and searched.get(cas, {}).get("status", 0) == 0
+                ]
+                start = time.perf_counter()
+                results = self.crw4_automation.multiple_search(to_add)
+                timing["adds"], timing["add_chemical"] = len(to_add), time.perf_counter() - start
+                if not results or results["status"] != 0:
+                    raise RuntimeError(f"批次 {batch_name} 新增化學品失敗")
+                for item in results["result"]:
+                    searched[item["cas"]] = item
+                    if item["status"] == 0:
+                        in_mixture.add(item["cas"])
+
+                start = time.perf_counter()
+                discard_crw4_export()
+                self.crw4_automation.output_chart_to_csv()
+                copied = self.copy_verified_export(batch_name, sorted(in_mixture), batch)
+                if copied["status"] == 0:
+                    verified[batch_name] = sorted(in_mixture)
+                    self.ingest_export(copied["path"])
+                timing["export"] = time.perf_counter() - start
+                record_timing(timings_path, timing)
+                self.crw4_automation.click_button("Mixture\rManager")
+
+                batch_results = {"status": 0, "result": [searched[cas] for cas in dict.fromkeys(batch) if cas in searched]}
+                formatted_result = self.crw4_automation.format_output(batch_name, batch_results)
+                result = file_handler("json", formatted_result, batch_name)
+                outputs[batch_name] = result["result"]
+
+            self.crw4_automation.clear_mixture()
+
+        except Exception as e:
+            return {"status": 1, "result": e.args[0], "error": e.__class__.__name__, "done": list(outputs), "verified": verified}
+
+        return {"status": 0, "result": outputs, "done": list(outputs), "verified": verified}
+
+    def capture_signatures(self, cas_list, cache:SignatureCache):
+        """排程前先搜尋尚未快取的 CAS 並紀錄其反應基團 (不需加入化合物)"""
+        for cas in tqdm(cache.missing(cas_list)):
+            if not self.crw4_automation.set_edit_field("Field: Chemicals::y_gSearchCAS", cas):
+                continue
+            self.crw4_automation.click_button("Search")
+            result = self.crw4_automation.check_search_results(cas)
+            self.crw4_automation.remember(cas, result)
+            if result["status"] == 0:
+                cache.set(cas, self.crw4_automation.read_reactive_groups())
+        return cache
+
 class CRW4Algorithm(CRW4Mechanization):
     def __init__(self, mechanization:CRW4Mechanization):
         self.mechanization = mechanization
@@ -123,68 +593,169 @@ class CRW4Algorithm(CRW4Mechanization):
         self.daily_json_path = daily_json_path
         self.output_base = output_base
         self.max_batch_size = 100
-        self.sub_chunk_size = 50
-        self.base_subgroups = {}
-
-    def split_list(self, data, chunk_size):
-        """將 data 切分成每個大小不超過 chunk_size 的子清單"""
-        return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
-
-    def split_group_with_labels(self, group, label):
-        """將一組資料依 sub_chunk_size 切分，並標記上半部與下半部"""
-        subs = self.split_list(group, self.sub_chunk_size)
-        result = {}
-        if not subs:
-            return result
-        if len(subs) == 1:
-            result[label] = subs[0]
-        else:
-            result[label] = subs[0]
-            result[label + "'"] = subs[1]
-        return result
-
-    def process_base_data(self):
-        """處理基礎 JSON 資料並進行分組"""
+        self.strategy = "best"  # 基礎資料排程方式，見 planner.py
+        self.delta = False  # True 時以增量方式執行批次，只替換相鄰批次間不同的化學品
+        self.coverage = self.mechanization.coverage  # 已計算配對索引 (匯出檔寫入 pair_store 時一併標記)
+        self.signatures = SignatureCache(os.path.join(OUTPUT_PATH, "signatures.json"), crw4_version())  # 反應基團快取
+        # True 時反應基團相同的化學品只送一筆代表進 CRW4；Reactive Groups 窗格的控制項尚未在實際的 CRW4 上確認，預設關閉
+        self.dedupe = False
+        self.classes = self.mechanization.classes  # 代表 CAS -> 同類所有 CAS
+        self.mechanization.crw4_automation.signatures = self.signatures
+        self.partition = PartitionManifest(f"{self.output_base}partition.json", self.max_batch_size)  # 基礎資料分組紀錄
+
+    def read_base_cas(self):
+        """讀取基礎 JSON 的 success_item 並取出 CAS 號碼列表"""
         with open(self.base_json_path, 'r', encoding='utf-8') as f:
             data = json.load(f)
         
         success_items = data.get("success_item", [])
-        cas_list = [list(item.keys())[0] for item in success_items]
+        cas_list = preflight([list(item.keys())[0] for item in success_items])["valid"]
         
         logger.debug(f"從基礎 JSON 中抽取到 {len(cas_list)} 筆 CAS 資料。")
-        groups = self.split_list(cas_list, self.max_batch_size)
-        group_labels = [chr(ord('A') + i) for i in range(len(groups))]
+        return cas_list
+
+    def process_base_data(self, dry_run=False):
+        """
+        以分組紀錄 (partition.json) 處理基礎資料：既有化學品留在原組別，新化學品補進有空位的組別，
+        只重寫有變動的 {label}.json，回傳依組別順序排列的基礎 CAS 清單
+        dry_run=True 時在分組紀錄的複本上計算，不寫入任何檔案也不變更配對索引
+        """
+        cas_list = self.read_base_cas()
+        # 基礎資料中已移除的化學品視為除役，其餘組別不受影響
+        base_set = set(cas_list)
+        retired = [cas for cas in self.partition.cas_list() if cas not in base_set]
+        if dry_run:
+            partition = self.partition.preview()
+            partition.retire(retired)
+            partition.update(cas_list)
+            return partition.cas_list()
+
+        changed = self.retire(retired)
+        changed += [label for label in self.partition.update(cas_list) if label not in changed]
+        self.coverage.restore(cas_list)  # 重新加入基礎資料的化學品沿用先前的配對結果
         
-        for label, group in zip(group_labels, groups):
+        for label in changed:
+            group = [cas for cas in self.partition.groups[label] if cas is not None]
             logger.info(f"組 {label} 有 {len(group)} 筆資料")
             file_name = f"{self.output_base}{label}.json"
             with open(file_name, 'w', encoding='utf-8') as f:
                 json.dump(group, f, ensure_ascii=False, indent=4)
-        
-        for label, group in zip(group_labels, groups):
-            subgroups = self.split_group_with_labels(group, label)
-            self.base_subgroups.update(subgroups)
+        return self.partition.cas_list()
+
+    def retire(self, cas_list):
+        """除役化學品：在分組與配對索引中標記，不會觸發任何 CRW4 重算，回傳有變動的組別"""
+        self.coverage.retire(cas_list)
+        return self.partition.retire(cas_list)
 
     def process_daily_data(self):
         """讀取日新增資料 JSON"""
         with open(self.daily_json_path, 'r', encoding='utf-8') as f:
             data = json.load(f)
-        daily_data = data.get("daily", [])
+        daily_data = preflight(data.get("daily", []))["valid"]
         logger.info(f"從日新增 JSON 中抽取到 {len(daily_data)} 筆資料。")
-        if len(daily_data) > 50:
-            return logger.error("每日新增資料超過 50 筆，請重新檢查。")
         return daily_data
 
-    def daily_algrthom(self):
-        """對基礎資料與日新增資料進行cross-pair處理"""
-        self.process_base_data()
+    def run_batches(self, batches, mixture_name, dry_run=False):
+        """
+        執行批次，匯出檔驗證通過的批次配對會寫入 pair_store 與配對索引
+        dry_run=True 時不操作 CRW4，只依過去的執行紀錄估算操作次數與時間
+        """
+        if dry_run:
+            estimate = CostModel.from_file(timings_path).estimate(batches, delta=self.delta)
+            logger.highlight(f"dry-run 預估: {estimate}")
+            return estimate
+
+        if self.delta:
+            return self.mechanization.automate_delta(batches, mixture_name=mixture_name)
+
+        results = {}
+        for batch_name, batch in batches.items():
+            results[batch_name] = self.run_batch(batch_name, batch)
+        return results
+
+    def run_batch(self, batch_name, batch):
+        """
+        執行單一批次；匯出檔驗證通過後由 automate 寫入 pair_store 與配對索引，
+        只有實際加入化合物的化學品之間的配對算已計算 (找不到、複數筆無法決定或新增失敗的化學品不算)
+        """
+        logger.highlight(f"處理批次 {batch_name} (共 {len(batch)} 筆)")
+        result = self.mechanization.automate(batch, batch_name)
+        logger.info(f'result:{result}')
+        if result.get("cached") and result.get("xlsx") and result.get("added"):
+            # 由回應快取取得的結果 (例如先前經由 /auto 執行過)：重新寫入配對結果，確保配對索引已標記
+            self.mechanization.ingest_export(result["xlsx"])
+        return result
+
+    def prefilter(self, cas_list):
+        """依搜尋快取排除已知找不到 (status 1) 或無法決定選取哪一筆 (status 2) 的化學品，不需操作 GUI"""
+        lookup_cache = self.mechanization.lookup_cache
+        skipped = set(
+            cas for cas in lookup_cache.statuses(cas_list, (2,))
+            if self.mechanization.resolutions.resolve(cas, lookup_cache.get(cas)["chemical_name"]) is None
+        )
+        skipped.update(cas for cas in cas_list if cas in self.mechanization.negative_cache)
+        if skipped:
+            logger.info(f"搜尋快取排除 {len(skipped)} 筆無法加入化合物的化學品")
+        return [cas for cas in cas_list if cas not in skipped]
+
+    def deduplicate(self, cas_list, dry_run=False):
+        """
+        取得反應基團後只保留每類的代表，回傳代表清單
+        dry_run=True 時不搜尋 CRW4，只使用已快取的反應基團 (未快取的各自成一類)
+        """
+        cas_list = self.prefilter(cas_list)
+        if not self.dedupe:
+            return cas_list
+        if not dry_run:
+            self.mechanization.capture_signatures(cas_list, self.signatures)
+        representatives, classes = collapse(cas_list, self.signatures)
+        if not dry_run:
+            self.classes.update(classes)
+        return representatives
+
+    def daily_algrthom(self, dry_run=False):
+        """對基礎資料與日新增資料進行cross-pair處理，批次大小依日新增筆數調整 (見 planner.daily_plan)"""
+        base_cas = self.process_base_data(dry_run)
         daily_data = self.process_daily_data()
-        daily_label = "X"
+        representatives = self.deduplicate(base_cas + daily_data, dry_run)
+        rep_set = set(representatives)
+        base_cas = [cas for cas in base_cas if cas in rep_set]
+        daily_data = [cas for cas in daily_data if cas in rep_set]
+        if self.coverage.cas_list:
+            # 只排程配對索引中尚未計算過的日新增配對
+            batches = plan_uncovered(daily_data + base_cas, self.coverage, self.max_batch_size, focus=daily_data)
+        else:
+            batches = daily_plan(daily_data, base_cas, self.max_batch_size)
+        logger.info(f"日新增 {len(daily_data)} 筆，基礎 {len(base_cas)} 筆，共需 {len(batches)} 批次")
         
-        logger.info("\n=== 日新增資料與基礎資料子組間反應計算 ===")
-        for base_label, base_group in self.base_subgroups.items():
-            batch = daily_data + base_group
-            logger.highlight(f"處理組 {daily_label} 與組 {base_label} 的子組配對 (共 {len(batch)} 筆)")
-            result = self.mechanization.automate(batch, 'X'+base_label)
-            logger.info(f'result:{result}')
-
+        logger.info("\n=== 日新增資料與基礎資料間反應計算 ===")
+        return self.run_batches(batches, "daily", dry_run)
+
+    def plan_base(self, dry_run=False):
+        """
+        依 self.strategy 產生能涵蓋所有尚未計算的基礎資料配對的最少批次
+        dry_run=True 時不操作 CRW4 也不寫入分組紀錄與配對索引
+        """
+        cas_list = self.deduplicate(self.process_base_data(dry_run), dry_run)
+        batches = plan_uncovered(cas_list, self.coverage, self.max_batch_size, strategy=self.strategy)
+        report = savings_report(cas_list, len(batches), self.max_batch_size, self.strategy, self.coverage)
+        report["coverage"] = self.coverage.stats(cas_list)
+        logger.info(f"基礎資料排程: {report}")
+        return batches, report
+
+    def base_algrthom(self, dry_run=False):
+        """產生基礎資料排程並逐一執行"""
+        batches, report = self.plan_base(dry_run)
+
+        logger.info("\n=== 基礎資料批次反應計算 ===")
+        return {"report": report, "result": self.run_batches(batches, "base", dry_run)}
+
+    def queue_backfill(self, scheduler:CRW4Scheduler):
+        """
+        將基礎資料回補以「每批次一個工作」送入排程器 (BACKFILL 等級)，
+        即時查詢與每日配對可在批次之間插隊，回傳排入的批次數
+        """
+        batches, report = self.plan_base()
+        for batch_name, batch in batches.items():
+            scheduler.submit(BACKFILL, self.run_batch, batch_name, batch, label=batch_name, key=f"batch:{batch_name}")
+        return report
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 專案模組都在根目錄 (非套件)，讓測試可以直接 import
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
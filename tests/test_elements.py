@@ -0,0 +1,113 @@
+import pytest
+
+from elements import ElementCache
+
+
+class FakeWrapper:
+    def __init__(self, criteria):
+        self.criteria = criteria
+        self.visible = True
+        self.clicks = 0
+
+    def is_visible(self):
+        return self.visible
+
+    def click_input(self):
+        self.clicks += 1
+
+
+class FakeSpec:
+    def __init__(self, window, criteria):
+        self.window = window
+        self.criteria = criteria
+
+    def wrapper_object(self):
+        self.window.resolves += 1
+        wrapper = FakeWrapper(self.criteria)
+        self.window.wrappers.append(wrapper)
+        return wrapper
+
+    def click_input(self):
+        self.wrapper_object().click_input()
+
+
+class FakeWindow:
+    """模擬 pywinauto 視窗樹：每次 wrapper_object() 都是一次 UIA 搜尋，回傳新的 wrapper"""
+    def __init__(self):
+        self.resolves = 0
+        self.wrappers = []
+
+    def child_window(self, **criteria):
+        return FakeSpec(self, criteria)
+
+
+SEARCH = {"title": "Search", "control_type": "Button"}
+
+
+def test_hit_reuses_wrapper():
+    window = FakeWindow()
+    cache = ElementCache(window)
+    first = cache.get(**SEARCH)
+    assert cache.get(**SEARCH) is first
+    assert window.resolves == 1
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_criteria_are_keyed_independently():
+    window = FakeWindow()
+    cache = ElementCache(window)
+    search = cache.get(**SEARCH)
+    edit = cache.get(auto_id="Field: Chemicals::y_gSearchCAS", control_type="Edit")
+    assert search is not edit
+    assert cache.get(control_type="Button", title="Search") is search
+    assert cache.stats()["cached"] == 2
+
+
+def test_stale_wrapper_is_resolved_again():
+    window = FakeWindow()
+    cache = ElementCache(window)
+    first = cache.get(**SEARCH)
+    first.visible = False
+    second = cache.get(**SEARCH)
+    assert second is not first
+    assert window.resolves == 2
+    assert cache.stats()["stale"] == 1
+
+
+def test_is_visible_error_counts_as_stale():
+    window = FakeWindow()
+    cache = ElementCache(window)
+    first = cache.get(**SEARCH)
+
+    def gone():
+        raise RuntimeError("element not available")
+    first.is_visible = gone
+    assert cache.get(**SEARCH) is not first
+    assert cache.stats()["stale"] == 1
+
+
+def test_invalidate():
+    window = FakeWindow()
+    cache = ElementCache(window)
+    search = cache.get(**SEARCH)
+    edit = cache.get(auto_id="Field: Chemicals::y_gSearchCAS", control_type="Edit")
+    cache.invalidate(**SEARCH)
+    assert cache.get(**SEARCH) is not search
+    assert cache.get(auto_id="Field: Chemicals::y_gSearchCAS", control_type="Edit") is edit
+    cache.invalidate()
+    assert cache.stats()["cached"] == 0
+
+
+def test_click_button_caches_only_stable_buttons():
+    pytest.importorskip("pywinauto")
+    from util import CRW4Automation
+
+    window = FakeWindow()
+    automation = CRW4Automation(app=None, window=window)
+    for _ in range(3):
+        automation.click_button("Search")
+        automation.click_button("OK")
+    search = [w for w in window.wrappers if w.criteria["title"] == "Search"]
+    ok = [w for w in window.wrappers if w.criteria["title"] == "OK"]
+    assert len(search) == 1 and search[0].clicks == 3
+    assert len(ok) == 3 and all(w.clicks == 1 for w in ok)
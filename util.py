@@ -2,6 +2,7 @@ import json
 import time
 import os
 import shutil
+import hashlib
 
 from functools import wraps
 from flask_restx import abort
@@ -12,6 +13,8 @@ from tqdm import tqdm
 import pyperclip
 
 from logger import logger
+from elements import ElementCache
+from archive import ExportArchive
 
 with open ("config.json", "r") as f:
     config = json.load(f)
@@ -21,10 +24,17 @@ OUTPUT_PATH = config["OUTPUT_PATH"]
 crw4_automation = None
 
 class CRW4Automation:
+    CACHED_BUTTONS = ("Search",)  # 每筆化學品都會點擊、且一直存在於主視窗的按鈕
+
     def __init__(self, app:Application, window=None):
         self.app = app
         self.main_window = window
         self.checked_mixture = False
+        self.signatures = None  # SignatureCache，設定後新增化學品時會一併紀錄反應基團
+        self.lookup_cache = None  # LookupCache，設定後搜尋結果會被快取，已知複數筆的 CAS 不再操作 GUI
+        self.negative_cache = None  # NegativeCache，已確認找不到的 CAS 直接回傳 status 1
+        self.resolutions = None  # ResolutionStore，複數筆搜尋結果依選擇紀錄/規則直接選取，不再放棄
+        self.elements = ElementCache(self.main_window)  # 主視窗固定控制項的 wrapper 快取
         if self.main_window == None :
             self.start()
     
@@ -32,12 +42,14 @@ class CRW4Automation:
         try:
             self.main_window = self.app.window(title_re="CRW4.*")
             self.main_window.wait('visible', timeout=20)
+            self.elements.root = self.main_window
+            self.elements.invalidate()
             self.click_button("OK")
         except Exception as e:
             logger.error(f"Failed to initialize CRW4 main window: {e}")
     
     def set_edit_field(self, auto_id, cas):
-        edit_field = self.main_window.child_window(auto_id=auto_id, control_type="Edit")
+        edit_field = self.elements.get(auto_id=auto_id, control_type="Edit")
         pyperclip.copy(cas) 
         edit_field.click_input()  
         edit_field.type_keys('^v') 
@@ -49,10 +61,17 @@ class CRW4Automation:
         return True
 
     def click_button(self, title, control_type="Button", window=None):
-        """根據標題(control identifiers)點擊按鈕 輸入方式click_buttion("標題")"""
+        """
+        根據標題(control identifiers)點擊按鈕 輸入方式click_buttion("標題")
+        只有主視窗上固定存在的按鈕 (CACHED_BUTTONS) 使用 wrapper 快取；對話框中的按鈕 (OK、Proceed、Export 等)
+        每次都會重新建立，快取的 wrapper 一定失效，也可能點到已隱藏但仍存在的舊對話框，因此每次重新搜尋
+        """
         try:
-            window = self.main_window if window == None else window
-            button = window.child_window(title=title, control_type=control_type)
+            if window == None and title in self.CACHED_BUTTONS:
+                button = self.elements.get(title=title, control_type=control_type)
+            else:
+                window = self.main_window if window == None else window
+                button = window.child_window(title=title, control_type=control_type)
             button.click_input()
             logger.debug(f"{title} button clicked successfully")
         except Exception as e:
@@ -72,7 +91,7 @@ class CRW4Automation:
     
     def check_search_results(self, cas):
         """檢查搜尋結果是否為一筆準確資料"""
-        control = self.main_window.child_window(auto_id="Field: Chemicals::y_gSearchResults", control_type="Edit")
+        control = self.elements.get(auto_id="Field: Chemicals::y_gSearchResults", control_type="Edit")
         legacy_value = control.legacy_properties().get("Value", "")
         status = legacy_value.split('g')[0] + 'g'
 
@@ -95,11 +114,36 @@ class CRW4Automation:
             return {"status": 2, "result": {"cas":cas, "chemical_name": chemical_list}}
         
         chemical = legacy_value.split('>')[1].split('\\r')[0]
-        offical_name = self.main_window.child_window(auto_id="Field: SearchResults::OfficialChemicalName", control_type="Edit", found_index=0).legacy_properties()['Value']
+        offical_name = self.elements.get(auto_id="Field: SearchResults::OfficialChemicalName", control_type="Edit", found_index=0).legacy_properties()['Value']
         result = f"cas:{cas} 找到一筆準確資料: {chemical}"
         logger.info(result)
         return {"status": 0, "result": {"cas":cas, "chemical_name": offical_name}}
 
+    def remember(self, cas, result):
+        """將 check_search_results 的結果寫入搜尋快取 (找不到的寫入 negative_cache)"""
+        if result.get("status") == 1:
+            if self.negative_cache is not None:
+                self.negative_cache.add(cas)
+        elif self.lookup_cache is not None:
+            self.lookup_cache.put_search_result(cas, result)
+
+    def read_reactive_groups(self):
+        """讀取目前搜尋結果化學品的反應基團 (Reactive Groups) 名稱列表，找不到欄位時回傳 None"""
+        groups = []
+        panel = self.main_window.child_window(title="Reactive Groups", control_type="Pane", found_index=0)
+        # 不等待：欄位不存在時每筆新化學品都會多花等待時間
+        if not panel.exists(timeout=0):
+            logger.debug("找不到 Reactive Groups 欄位")
+            return None
+        for i in range(1, 31):
+            row = panel.child_window(title=f"Portal Row View {str(i)}", control_type="DataItem")
+            group_field = row.child_window(auto_id="Field: ChemicalReactiveGroups::ReactiveGroupName", control_type="Edit", found_index=0)
+            if not group_field.exists():
+                break
+            groups.append(group_field.legacy_properties()['Value'].strip())
+        logger.debug(f"反應基團: {groups}")
+        return groups
+
     def add_mixture(self, mixture_name):
         """
         新增化合物至CRW4 
@@ -114,6 +158,25 @@ class CRW4Automation:
         logger.info("Mixture added successfully")
         return {"status": 0, "result": f"化合物{mixture_name}創建成功"}
 
+    def select_mixture(self, mixture_name):
+        """從化合物下拉選單選取既有的化合物 (中斷後接續執行時重新連上原本的化合物)"""
+        try:
+            dropdown_menu = self.main_window.child_window(control_type="Menu", auto_id="Field: Chemicals::y_gMixtureNameSelect")
+            dropdown_menu.click_input()
+            combobox = self.app.window(title_re="路徑位置")
+            if not combobox.exists(timeout=1):
+                return {"status": 1, "result": "找不到路徑位置，可能是化學品選取視窗未完全開啟"}
+            menu_item = combobox.child_window(title=mixture_name, control_type="MenuItem")
+            if not menu_item.exists():
+                combobox.type_keys("{ESC}")
+                return {"status": 1, "result": f"找不到化合物 {mixture_name}"}
+            menu_item.click_input()
+            self.checked_mixture = True
+            logger.info(f"已重新選取化合物 {mixture_name}")
+            return {"status": 0, "result": f"已重新選取化合物 {mixture_name}"}
+        except Exception as e:
+            return {"status": 1, "result": f"選取化合物失敗: {e}", "error": e.__class__.__name__}
+
     def add_chemical(self, cas):
         """新增化學品至CRW4
         payload:{
@@ -128,10 +191,18 @@ class CRW4Automation:
         status 0=成功 1=找不到資料 2=找到複數筆資料 3=使用者尚未選取化合物 4=異常錯誤
         """
         try:
+            ##搜尋快取中已確認找不到或複數筆的CAS直接回傳，不需操作GUI
+            if self.negative_cache is not None and cas in self.negative_cache:
+                return self.negative_cache.search_result(cas)
+            cached = self.lookup_cache.get(cas) if self.lookup_cache is not None else None
+            if cached and cached["status"] == 2 and not self.resolve(cas, cached["chemical_name"]):
+                return {"status": 2, "result": {f"{cas}_{i}": name for i, name in enumerate(cached["chemical_name"], start=1)}}
+
             if not self.set_edit_field("Field: Chemicals::y_gSearchCAS", cas):
                 return {"status": 4, "result": f"無法將文字寫入cas窗格Chemicals::y_gSearchCAS"}
             self.click_button("Search") 
             result = self.check_search_results(cas)
+            self.remember(cas, result)
 
             if result["status"] == 2 :
                 result = {}
@@ -145,41 +216,89 @@ class CRW4Automation:
                     else:
                         logger.debug(f"{cas} 總共有 {i-1} 筆相同的資料")
                         break
-                logger.info(f"cas 複數結果: {result}")
-                return {"status": 2, "result": result}
+                choice = self.resolve(cas, list(result.values()), decide=True)
+                if choice is None:
+                    logger.info(f"cas 複數結果: {result}")
+                    return {"status": 2, "result": result}
+                index, offical_name = choice
+                logger.info(f"cas:{cas} 複數結果選取第 {index} 筆: {offical_name}")
+                return self.select_result_row(cas, index, offical_name)
 
             elif result["status"] != 0:
                 logger.warning(f"Search result: {result}")
                 return {"status": result["status"], "result": result["result"]}
             
-            ##找到化學品視窗以點擊兩次
-            ##portal_view有複數個相同名稱的視窗，所以指定index=0，也就是找到的第一個。
-            portal_view = self.main_window.child_window(title="Portal View", control_type="Pane", found_index=0)
-            target_item = portal_view.child_window(title="Portal Row View 1", control_type="DataItem")
-            # target_item.window().set_focus() ## developing
-            time.sleep(0.2)
-            target_item.click_input()
-            target_item.click_input()
-            ##防呆機制
-            if not self.checked_mixture:
-                logger.debug("檢查是否選取化學品")
-                if self.main_window.child_window(title="No mixture selected", control_type="Window").exists(timeout=1):
-                    logger.warning("No mixture selected")
-                    return {"status": 3, "result": "使用者尚未選取化合物，請創建化合物後再選取化學品"}
-                self.checked_mixture = True
-
             ##成功回傳化學品名稱及CAS
             ## v0.0.15 本來想要新增根據選取化合物裡面是否有相對名稱來判斷確定新增成功，但是發現CRW4化合物資料會根據ABCD順序排序，太複雜故先不做此判斷
-            offical_name = self.main_window.child_window(auto_id="Field: SearchResults::OfficialChemicalName", control_type="Edit", found_index=0).legacy_properties()['Value']
+            offical_name = self.elements.get(auto_id="Field: SearchResults::OfficialChemicalName", control_type="Edit", found_index=0).legacy_properties()['Value']
             # chemical_name = self.main_window.child_window(auto_id="Field: MixtureInfo::ChemName", control_type="Edit").legacy_properties()['Value']
             # current_cas = self.main_window.child_window(auto_id="Field: MixtureInfo::CASNum", control_type="Edit").legacy_properties()['Value']
 
             # if current_cas == cas:
-            logger.info("Selected item successfully")
-            return {"status": 0, "result": {"cas": cas, "chemical_name": offical_name}}
+            return self.select_result_row(cas, 1, offical_name)
         except Exception as e:
             logger.error(f"Failed to select item: {cas}")
-            return {"status": 1, "result": f"檢查到選取化學品 {chemical_name} 新增失敗"}
+            return {"status": 1, "result": f"檢查到選取化學品 {cas} 新增失敗", "error": e.__class__.__name__}
+
+    def resolve(self, cas, names, decide=False):
+        """
+        複數筆搜尋結果依 resolutions 決定要選取的列，回傳 (Portal Row View 編號, 名稱) 或 None；
+        decide=True 表示實際要選取，規則選出的結果會寫入選擇紀錄
+        """
+        if self.resolutions is None:
+            return None
+        if decide:
+            return self.resolutions.decide(cas, names)
+        return self.resolutions.resolve(cas, names)
+
+    def select_result_row(self, cas, index, offical_name):
+        """雙擊搜尋結果的第 index 列將化學品加入化合物"""
+        ##找到化學品視窗以點擊兩次
+        ##portal_view有複數個相同名稱的視窗，所以指定index=0，也就是找到的第一個。
+        portal_view = self.main_window.child_window(title="Portal View", control_type="Pane", found_index=0)
+        target_item = portal_view.child_window(title=f"Portal Row View {str(index)}", control_type="DataItem")
+        # target_item.window().set_focus() ## developing
+        time.sleep(0.2)
+        target_item.click_input()
+        target_item.click_input()
+        ##防呆機制
+        if not self.checked_mixture:
+            logger.debug("檢查是否選取化學品")
+            if self.main_window.child_window(title="No mixture selected", control_type="Window").exists(timeout=1):
+                logger.warning("No mixture selected")
+                return {"status": 3, "result": "使用者尚未選取化合物，請創建化合物後再選取化學品"}
+            self.checked_mixture = True
+
+        if self.signatures is not None and cas not in self.signatures:
+            self.signatures.set(cas, self.read_reactive_groups())
+        logger.info("Selected item successfully")
+        return {"status": 0, "result": {"cas": cas, "chemical_name": offical_name}}
+
+    def remove_chemical(self, cas):
+        """從目前的化合物中移除單一化學品 (增量執行時只換掉有變動的化學品)
+        status 0=成功 1=化合物中找不到該化學品 4=異常錯誤
+        """
+        try:
+            ##化合物清單與搜尋結果同樣是Portal View，以MixtureInfo::CASNum找到對應的列
+            for i in range(1, 101):
+                row = self.main_window.child_window(title=f"Portal Row View {str(i)}", control_type="DataItem", found_index=1)
+                cas_field = row.child_window(auto_id="Field: MixtureInfo::CASNum", control_type="Edit", found_index=0)
+                if not cas_field.exists():
+                    break
+                if cas_field.legacy_properties()['Value'].strip() != cas:
+                    continue
+                row.click_input()
+                self.click_button("Remove")
+                confirm = self.main_window.child_window(title="OK", control_type="Button")
+                if confirm.exists(timeout=1):
+                    confirm.click_input()
+                logger.info(f"cas:{cas} 已從化合物中移除")
+                return {"status": 0, "result": {"cas": cas}}
+            logger.warning(f"cas:{cas} 不在目前的化合物中")
+            return {"status": 1, "result": {"cas": cas}}
+        except Exception as e:
+            logger.error(f"Failed to remove item: {cas}, {e}")
+            return {"status": 4, "result": f"移除化學品 {cas} 失敗: {e}"}
 
     def output_chart_to_csv(self):
         self.click_button("Compatibility\rChart")
@@ -400,11 +519,18 @@ class CRW4Automation:
     def multiple_check(self, cas_list):
         results = []
         for i, cas in enumerate(tqdm(cas_list)):
+            if self.negative_cache is not None and cas in self.negative_cache:
+                results.append(self.negative_cache.check_item(cas))
+                continue
+            if self.lookup_cache is not None and cas in self.lookup_cache:
+                results.append(self.lookup_cache.check_item(cas))
+                continue
             try:
                 if not self.set_edit_field("Field: Chemicals::y_gSearchCAS", cas):
                     return logger.error(f"新增化學品 {cas}失敗 導致過程暫停,原因:{result['result']}")
                 self.click_button("Search") 
                 result = self.check_search_results(cas)
+                self.remember(cas, result)
 
                 if not self.checked_mixture:
                     if self.main_window.child_window(title="No mixture selected", control_type="Window").exists(timeout=1):
@@ -425,9 +551,11 @@ class CRW4Automation:
             except Exception as e:
                 results.append({"cas": cas, "status": 1, "error": str(e)})
 
+        logger.debug(f"控制項快取: {self.elements.stats()}")
         return {"status": 0, "result": results}
             
-    def multiple_search(self, cas_list):
+    def multiple_search(self, cas_list, on_result=None):
+        """依序新增化學品；on_result(item) 會在每筆完成後呼叫 (例如寫入執行紀錄)"""
         results = []
         for i, cas in enumerate(tqdm(cas_list)):
             try:
@@ -444,10 +572,17 @@ class CRW4Automation:
                     "status": status,
                     "result": result.get("result") if status != 2 else {k: v for k, v in result.items() if k != "status"}
                 })
+                if result.get("error"):
+                    # 例外造成的失敗不是確定的搜尋結果 (例如不會寫入執行紀錄)
+                    results[-1]["error"] = result["error"]
 
             except Exception as e:
                 results.append({"cas": cas, "status": 1, "error": str(e)})
 
+            if on_result is not None:
+                on_result(results[-1])
+
+        logger.debug(f"控制項快取: {self.elements.stats()}")
         return {"status": 0, "result": results}
 
 
@@ -521,14 +656,76 @@ def check_for_file_ready(file_path, max_attempts=5, interval=3):
 
     return False
 
-def file_handler(file_type: str, data=None, id=None):
+_crw4_version = None
+
+def crw4_version():
+    """
+    以 CRW4 主程式 (CRW4_PATH) 與 config.json 的 CRW4_VERSION_FILES (安裝目錄下唯讀的化學品資料庫/版本檔) 的
+    名稱、大小、修改時間產生版本指紋，CRW4 或其資料庫更新時指紋才會改變。
+    安裝目錄內其他檔案 (建立/刪除化合物時 CRW4 會寫入的資料檔、匯出的 xlsx 等) 不列入，一般操作不會讓快取作廢
+    """
+    global _crw4_version
+    if _crw4_version is None:
+        install_dir = os.path.dirname(PATH)
+        digest = hashlib.sha1()
+        for file_path in [PATH] + [os.path.join(install_dir, name) for name in config.get("CRW4_VERSION_FILES", [])]:
+            if not os.path.isfile(file_path):
+                logger.warning(f"找不到 CRW4 版本指紋使用的檔案 {file_path}")
+                continue
+            stat = os.stat(file_path)
+            digest.update(f"{os.path.basename(file_path)}:{stat.st_size}:{int(stat.st_mtime)}".encode("utf-8"))
+        _crw4_version = digest.hexdigest()[:16]
+    return _crw4_version
+
+_export_archive = None
+
+def export_archive():
+    """OUTPUT_PATH/archive 下的匯出封存 (第一次使用時載入 manifest)"""
+    global _export_archive
+    if _export_archive is None:
+        _export_archive = ExportArchive(os.path.join(OUTPUT_PATH, "archive"))
+    return _export_archive
+
+def output_basename(id):
+    """輸出檔名 SDS_911058_{id}_{日期}"""
+    return f"SDS_911058_{id}_{time.strftime('%Y%m%d')}"
+
+def xlsx_destination(id, blob=None):
+    """
+    批次 id 的 xlsx 輸出路徑 (OUTPUT_PATH/xlsx/..._CRW_Data_Export.xlsx)；blob (封存的內容雜湊) 指定時檔名加上雜湊前 12 碼，
+    同日同 id 的不同結果不會互相覆蓋，相同的結果只保留一份
+    """
+    xlsx_path = os.path.join(OUTPUT_PATH, "xlsx")
+    os.makedirs(xlsx_path, exist_ok=True)
+    name = f"{output_basename(id)}_{blob[:12]}" if blob else output_basename(id)
+    return os.path.join(xlsx_path, f"{name}_CRW_Data_Export.xlsx")
+
+def crw4_export_path():
+    """CRW4 Export Chart Data 寫出的 CRW_Data_Export.xlsx 位置"""
+    return os.path.join(PATH.split("\\")[0], "\\Program Files (x86)\\CRW4", "CRW_Data_Export.xlsx")
+
+def discard_crw4_export():
+    """重新輸出圖表前移除舊的 CRW_Data_Export.xlsx，避免 check_for_file_ready 把上一次的檔案當成這次的結果"""
+    source_path = crw4_export_path()
+    try:
+        if os.path.exists(source_path):
+            os.remove(source_path)
+    except OSError as e:
+        logger.warning(f"無法移除舊的匯出檔 {source_path}: {e}")
+
+def file_handler(file_type: str, data=None, id=None, source_path=None, blob=None):
+    """
+    json：將 data 寫入 OUTPUT_PATH/json；xlsx：將 CRW4 輸出的 xlsx 複製到 OUTPUT_PATH/xlsx
+    source_path 指定時改由該檔案複製 (例如已驗證的匯出檔)，不需等待 CRW4 寫入
+    blob 為 export_archive 中的內容雜湊，輸出檔名會帶上雜湊 (見 xlsx_destination)，內容相同的檔案已存在時不再複製
+    成功時 result 中的 "path" 為輸出檔案路徑
+    """
     if file_type not in ["json", "xlsx"]:
         logger.error(f"Invalid file type: {file_type}")
         return {"status": 1, "result": "Invalid file type"}
 
     os.makedirs(OUTPUT_PATH, exist_ok=True)
-    current_time = time.strftime("%Y%m%d")
-    base_filename = f"SDS_911058_{id}_{current_time}"
+    base_filename = output_basename(id)
     
     try:
         if file_type == "json":
@@ -538,22 +735,24 @@ def file_handler(file_type: str, data=None, id=None):
             with open(destination_path, 'w', encoding='utf-8') as f:
                 json.dump(data, f, ensure_ascii=False, indent=4)
             logger.info(f"JSON file successfully saved to {destination_path}")
-            result = {"status": 0, "result": f"JSON file successfully saved to {destination_path}"}
+            result = {"status": 0, "result": f"JSON file successfully saved to {destination_path}", "path": destination_path}
         
         elif file_type == "xlsx":
-            xlsx_path = os.path.join(OUTPUT_PATH, "xlsx")
-            os.makedirs(xlsx_path, exist_ok=True)
-            source_path = os.path.join(PATH.split("\\")[0], "\\Program Files (x86)\\CRW4", "CRW_Data_Export.xlsx")
-            logger.debug(f"Checking for XLSX file at {source_path}")
-
-            if not check_for_file_ready(source_path, max_attempts=10, interval=3):
-                logger.error("Source file not ready after waiting.")
-                return {"status": 1, "result": "xlsx文件沒有被CRW4成功創建或寫入未完成，等待時間逾時"}
-
-            destination_path = os.path.join(xlsx_path, f"{base_filename}_CRW_Data_Export.xlsx")
-            shutil.copy2(source_path, destination_path)
-            logger.info(f"XLSX file successfully saved to {destination_path}")
-            result = {"status": 0, "result": f"XLSX file successfully saved to {destination_path}"}
+            if source_path is None:
+                source_path = crw4_export_path()
+                logger.debug(f"Checking for XLSX file at {source_path}")
+
+                if not check_for_file_ready(source_path, max_attempts=10, interval=3):
+                    logger.error("Source file not ready after waiting.")
+                    return {"status": 1, "result": "xlsx文件沒有被CRW4成功創建或寫入未完成，等待時間逾時"}
+
+            destination_path = xlsx_destination(id, blob)
+            if blob and os.path.exists(destination_path):
+                logger.info(f"XLSX file with the same content already exists at {destination_path}")
+            else:
+                shutil.copy2(source_path, destination_path)
+                logger.info(f"XLSX file successfully saved to {destination_path}")
+            result = {"status": 0, "result": f"XLSX file successfully saved to {destination_path}", "path": destination_path}
 
     except Exception as e:
         logger.error(f"Error saving file: {e}")